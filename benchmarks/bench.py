@@ -0,0 +1,344 @@
+"""Бенчмарки отрисовки и обработки событий без окна (SDL_VIDEODRIVER=dummy).
+
+    python benchmarks/bench.py --sizes 100,1000,5000 --output result.json
+
+Для каждого сценария и размера дерева измеряются: построение и первый кадр,
+кадры в секунду при изменении одного узла за кадр, пустой кадр, созданные
+поверхности (промахи пула) и выделенная Python память на кадр, задержка hit_test,
+get_node_by_name и разбора очереди событий. Результат — JSON, который можно
+сравнивать между версиями (benchmarks/compare.py)."""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sdl2
+import sdl2.ext
+import sdl2.sdlttf
+
+from simplePyUI.events import EventDispatcher
+from simplePyUI.main import Render, UIFactory
+from simplePyUI.profiler import FrameProfiler
+from simplePyUI.widgets import UIWidgetsFactory
+
+WIN_SIZE = (800, 600)
+DEEP_LIMIT = 200  # Глубина вложенности ограничена рекурсией обхода дерева
+SIZES = (100, 1000, 5000)
+FRAMES = 200
+QUERIES = 2000
+MOTION_EVENTS = 500
+COLOR = (40, 40, 40, 255)
+COLOR_TEXT = (255, 255, 255, 255)
+
+
+def default_font():
+    font = os.environ.get("SIMPLEPYUI_FONT")
+    if font:
+        return font
+    bundled = os.path.join(os.path.dirname(sdl2.__file__),
+                           "examples", "resources", "tuffy.ttf")
+    return bundled if os.path.exists(bundled) else None
+
+
+# Синтетические деревья: (factory, widgets, size) -> (корень, узлы для изменения)
+
+def build_deep(factory, widgets, size):
+    depth = min(size, DEEP_LIMIT)
+    chains = max(1, size // depth)
+    root = factory.Panel((0, 0), WIN_SIZE, [], color=(0, 0, 0, 255))
+    leaves = list()
+    for chain in range(chains):
+        node = factory.Panel((chain * 4 % WIN_SIZE[0], 0), (40, 40), [],
+                             color=COLOR, s_id="deep_%d_0" % chain)
+        root.nodes.append(node)
+        for level in range(1, depth):
+            child = factory.Panel((0, 1), (40, 40), [], color=COLOR,
+                                  s_id="deep_%d_%d" % (chain, level))
+            node.nodes.append(child)
+            node = child
+        leaves.append(node)
+    return root, leaves
+
+
+def build_wide_list(factory, widgets, size):
+    elements = widgets.elements_list((0, 0), (300, WIN_SIZE[1]), color=COLOR)
+    rows = list()
+    for i in range(size):
+        row = factory.Panel((0, 0), (300, 20), [], color=COLOR, s_id="row_%d" % i)
+        elements.add_elem(row)
+        rows.append(row)
+    root = factory.Panel((0, 0), WIN_SIZE, [elements], color=(0, 0, 0, 255))
+    return root, rows
+
+
+def build_matrix(factory, widgets, size):
+    side = max(1, int(math.sqrt(size)))
+    cells = list()
+    x_axes = list()
+    for x in range(side):
+        y_axes = list()
+        for y in range(side):
+            cell = factory.Panel((0, 0), (10, 10), [], color=COLOR,
+                                 s_id="cell_%d_%d" % (x, y))
+            y_axes.append(widgets.elements_matrix_axis((0, 0), [cell]))
+            cells.append(cell)
+        x_axes.append(widgets.elements_matrix_axis((0, 0), y_axes))
+    matrix = widgets.elements_matrix((0, 0), x_axes, element_size=(12, 12))
+    root = factory.Panel((0, 0), WIN_SIZE, [matrix], color=(0, 0, 0, 255))
+    return root, cells
+
+
+def build_labels(factory, widgets, size):
+    columns = 8
+    labels = list()
+    for i in range(size):
+        labels.append(widgets.label(
+            ((i % columns) * 100, (i // columns) * 20), (100, 20), None,
+            text="label %d" % i, s_id="label_%d" % i,
+            color=COLOR, color_text=COLOR_TEXT, text_size=12))
+    root = factory.Panel((0, 0), WIN_SIZE, labels, color=(0, 0, 0, 255))
+    return root, labels
+
+
+SCENARIOS = {
+    "deep": build_deep,
+    "wide_list": build_wide_list,
+    "matrix": build_matrix,
+    "labels": build_labels,
+}
+
+
+def mutate(node, frame):
+    if hasattr(node, "set_text"):
+        node.set_text("frame %d" % frame)
+    else:
+        node.color = (frame % 256, 40, 40, 255)
+
+
+def on_screen(nodes):
+    """Узлы, которые после раскладки хоть частично видны в окне:
+    изменения остальных отсекаются и кадр ничего не рисует"""
+    visible = list()
+    for node in nodes:
+        x, y = node.abs_pos
+        w, h = node.size
+        if x < WIN_SIZE[0] and y < WIN_SIZE[1] and x + w > 0 and y + h > 0:
+            visible.append(node)
+    return visible or nodes
+
+
+def count_nodes(root):
+    nodes = [root]
+    for node in nodes:
+        nodes.extend(node.nodes)
+    return len(nodes)
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def summary_us(samples):
+    return {
+        "mean": statistics.fmean(samples) * 1e6,
+        "p50": percentile(samples, 0.5) * 1e6,
+        "p95": percentile(samples, 0.95) * 1e6,
+    }
+
+
+def timed_each(fn, args):
+    samples = list()
+    clock = time.perf_counter
+    for arg in args:
+        start = clock()
+        fn(arg)
+        samples.append(clock() - start)
+    return samples
+
+
+def push_event(event_type, **fields):
+    event = sdl2.SDL_Event()
+    event.type = event_type
+    for name, value in fields.items():
+        group, field = name.split("_")
+        setattr(getattr(event, group), field, value)
+    sdl2.SDL_PushEvent(event)
+
+
+def bench_events(render, rng):
+    """Время разбора очереди: MOTION_EVENTS движений мыши, клик и прокрутка"""
+    dispatcher = EventDispatcher(render)
+    samples = list()
+    for _ in range(20):
+        sdl2.SDL_FlushEvents(sdl2.SDL_FIRSTEVENT, sdl2.SDL_LASTEVENT)
+        for _ in range(MOTION_EVENTS):
+            push_event(sdl2.SDL_MOUSEMOTION, motion_x=rng.randrange(WIN_SIZE[0]),
+                       motion_y=rng.randrange(WIN_SIZE[1]))
+        x, y = rng.randrange(WIN_SIZE[0]), rng.randrange(WIN_SIZE[1])
+        push_event(sdl2.SDL_MOUSEBUTTONDOWN, button_x=x, button_y=y)
+        push_event(sdl2.SDL_MOUSEBUTTONUP, button_x=x, button_y=y)
+        push_event(sdl2.SDL_MOUSEWHEEL, wheel_y=1)
+        events = sdl2.ext.get_events()
+        start = time.perf_counter()
+        dispatcher.dispatch(events)
+        samples.append(time.perf_counter() - start)
+    return summary_us(samples)
+
+
+def run_case(window, font, scenario, size, sprite_type, frames, seed):
+    rng = random.Random(seed)
+    factory = UIFactory(window)
+    widgets = UIWidgetsFactory(factory)
+
+    start = time.perf_counter()
+    root, mutable = SCENARIOS[scenario](factory, widgets, size)
+    build_s = time.perf_counter() - start
+
+    render = Render(window, root, font, sprite_type)
+    start = time.perf_counter()
+    render.draw()
+    first_frame_s = time.perf_counter() - start
+
+    # Кадры, в каждом из которых меняется один видимый узел
+    visible = on_screen(mutable)
+    targets = [rng.choice(visible) for _ in range(frames)]
+    profiler = FrameProfiler(history=frames)
+    profiler.attach(render)
+    frame_samples = list()
+    skipped = 0
+    for frame, node in enumerate(targets):
+        mutate(node, frame)
+        start = time.perf_counter()
+        drawn = render.draw()
+        spent = time.perf_counter() - start
+        # fps и frame_us — по тем же кадрам, что и phases_ms профилировщика
+        if drawn:
+            frame_samples.append(spent)
+        else:
+            skipped += 1
+    stats = profiler.stats()
+    profiler.detach()
+
+    # Без профилировщика, с трассировкой выделений Python
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    allocated = 0
+    for frame, node in enumerate(targets[:50]):
+        mutate(node, frame + frames)
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        render.draw()
+        allocated += tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+
+    idle_samples = timed_each(lambda _: render.draw(), range(frames))
+
+    points = [(rng.randrange(WIN_SIZE[0]), rng.randrange(WIN_SIZE[1]))
+              for _ in range(QUERIES)]
+    hit_samples = timed_each(render.hit_test, points)
+
+    names = [node.s_id for node in mutable if node.s_id]
+    lookups = [rng.choice(names) for _ in range(QUERIES)] if names else []
+    lookup_samples = timed_each(render.get_node_by_name, lookups) or [0.0]
+
+    events = bench_events(render, rng)
+
+    return {
+        "scenario": scenario,
+        "size": size,
+        "nodes": count_nodes(root),
+        "sprite_type": "texture" if sprite_type == sdl2.ext.TEXTURE else "software",
+        "build_ms": build_s * 1000,
+        "first_frame_ms": first_frame_s * 1000,
+        "targets_on_screen": len(visible),
+        "skipped_frames": skipped,
+        "fps": len(frame_samples) / sum(frame_samples) if frame_samples else 0.0,
+        "frame_us": summary_us(frame_samples or [0.0]),
+        "phases_ms": {phase: values["mean"] for phase, values in stats["phases"].items()},
+        "surfaces_per_frame": stats["allocations_per_frame"],
+        "py_bytes_per_frame": allocated / 50,
+        "idle_frame_us": summary_us(idle_samples),
+        "hit_test_us": summary_us(hit_samples),
+        "lookup_us": summary_us(lookup_samples),
+        "event_batch_us": events,
+        "pool": render.surface_pool.stats(),
+    }
+
+
+def sdl_version():
+    version = sdl2.SDL_version()
+    sdl2.SDL_GetVersion(version)
+    return "%d.%d.%d" % (version.major, version.minor, version.patch)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--font", default=default_font())
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)))
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--frames", type=int, default=FRAMES)
+    parser.add_argument("--texture", action="store_true",
+                        help="рисовать через SDL_Renderer (sdl2.ext.TEXTURE)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="файл для JSON, по умолчанию stdout")
+    args = parser.parse_args(argv)
+    if not args.font:
+        parser.error("нужен --font или переменная SIMPLEPYUI_FONT")
+
+    sdl2.ext.init()
+    sdl2.sdlttf.TTF_Init()
+    sprite_type = sdl2.ext.TEXTURE if args.texture else sdl2.ext.SOFTWARE
+
+    results = list()
+    for scenario in args.scenarios.split(","):
+        for size in map(int, args.sizes.split(",")):
+            # Своё окно на каждый случай: SDL_Renderer привязывается к окну
+            window = sdl2.ext.Window("bench", WIN_SIZE)
+            results.append(run_case(window, args.font, scenario, size,
+                                    sprite_type, args.frames, args.seed))
+            window.close()
+            print("%-10s %6d  %8.1f fps" % (scenario, size, results[-1]["fps"]),
+                  file=sys.stderr)
+
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "pysdl2": sdl2.__version__,
+        "sdl": sdl_version(),
+        "video_driver": sdl2.SDL_GetCurrentVideoDriver().decode(),
+        "args": vars(args),
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text)
+    else:
+        print(text)
+    sdl2.sdlttf.TTF_Quit()
+    sdl2.ext.quit()
+
+
+if __name__ == "__main__":
+    main()
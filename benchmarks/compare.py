@@ -0,0 +1,50 @@
+"""Сравнение двух результатов bench.py.
+
+    python benchmarks/compare.py old.json new.json
+
+Для каждого сценария и размера печатает отношение new / old по основным
+метрикам; > 1 — стало медленнее (для fps — быстрее)."""
+import json
+import sys
+
+METRICS = (
+    ("fps", lambda result: result["fps"]),
+    ("frame", lambda result: result["frame_us"]["mean"]),
+    ("first", lambda result: result["first_frame_ms"]),
+    ("idle", lambda result: result["idle_frame_us"]["mean"]),
+    ("hit", lambda result: result["hit_test_us"]["mean"]),
+    ("lookup", lambda result: result["lookup_us"]["mean"]),
+    ("events", lambda result: result["event_batch_us"]["mean"]),
+    ("surfaces", lambda result: result["surfaces_per_frame"]),
+)
+
+
+def load(path):
+    with open(path) as report:
+        results = json.load(report)["results"]
+    return {(result["scenario"], result["size"], result["sprite_type"]): result
+            for result in results}
+
+
+def ratio(new, old):
+    if not old:
+        return "    -" if not new else "  inf"
+    return "%5.2f" % (new / old)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2:
+        sys.exit(__doc__)
+    old, new = load(argv[0]), load(argv[1])
+    print("%-22s" % "case" + "".join("%9s" % name for name, _ in METRICS))
+    for key in sorted(old.keys() & new.keys()):
+        scenario, size, sprite_type = key
+        row = "%-22s" % ("%s/%d/%s" % (scenario, size, sprite_type[0]))
+        for _name, metric in METRICS:
+            row += "%9s" % ratio(metric(new[key]), metric(old[key]))
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
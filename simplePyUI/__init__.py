@@ -1 +1 @@
-from .main import SimpleUI
\ No newline at end of file
+from .main import SimpleUI, UIApp
\ No newline at end of file
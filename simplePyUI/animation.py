@@ -0,0 +1,191 @@
+import heapq
+import itertools
+import math
+import time
+
+FPS = 60
+MAX_CATCH_UP = 5  # Шагов анимации за кадр, дальше время анимаций догоняет часы скачком
+
+
+def linear(k):
+    return k
+
+
+def ease_in_out(k):
+    return k * k * (3 - 2 * k)
+
+
+def ease_out_cubic(k):
+    return 1 - (1 - k) ** 3
+
+
+def _lerp(start, end, k):
+    if isinstance(start, (tuple, list)):
+        return type(start)(_lerp(a, b, k) for a, b in zip(start, end))
+    value = start + (end - start) * k
+    return round(value) if isinstance(start, int) and isinstance(end, int) else value
+
+
+class Tween:
+    """Плавное изменение свойства node.prop от start до end за duration секунд.
+    Числа и кортежи чисел (pos, size, color) интерполируются поэлементно"""
+
+    __slots__ = ("node", "prop", "start", "end", "t0", "duration", "easing",
+                 "on_done", "done")
+
+    def __init__(self, node, prop, start, end, t0, duration, easing, on_done):
+        self.node = node
+        self.prop = prop
+        self.start = start
+        self.end = end
+        self.t0 = t0
+        self.duration = duration
+        self.easing = easing
+        self.on_done = on_done
+        self.done = False
+
+    def cancel(self):
+        self.done = True
+
+    def apply(self, now):
+        k = min(1.0, (now - self.t0) / self.duration)
+        setattr(self.node, self.prop, _lerp(self.start, self.end, self.easing(k)))
+        if k >= 1.0:
+            self.done = True
+            if self.on_done:
+                self.on_done()
+
+
+class Timer:
+    __slots__ = ("deadline", "interval", "fn", "args", "cancelled")
+
+    def __init__(self, deadline, interval, fn, args):
+        self.deadline = deadline
+        self.interval = interval
+        self.fn = fn
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Scheduler:
+    """Таймеры и анимации, которые цикл UI выполняет в своём потоке.
+
+    Анимации идут с фиксированным шагом 1 / fps: их время продвигается
+    целыми шагами, поэтому значения не зависят от того, когда именно
+    проснулся цикл. next_deadline() говорит циклу, до какого момента
+    можно спать: до следующего шага анимации или ближайшего таймера.
+    Все методы вызываются только из потока UI (из других потоков —
+    через SimpleUI.call_soon или обёртки SimpleUI)."""
+
+    def __init__(self, fps=FPS, clock=time.perf_counter):
+        self.clock = clock
+        self.step = 1.0 / fps
+        self.time = None  # Время анимаций, None пока их нет
+        self.tweens = dict()  # (node, prop) -> Tween
+        self.timers = list()  # heap (deadline, seq, Timer)
+        self._seq = itertools.count()
+
+    @property
+    def fps(self):
+        return 1.0 / self.step
+
+    @fps.setter
+    def fps(self, fps):
+        self.step = 1.0 / fps
+
+    def call_later(self, delay, fn, *args):
+        return self._add_timer(delay, None, fn, args)
+
+    def call_every(self, interval, fn, *args):
+        if interval <= 0:
+            # Повтор с нулевым шагом снова наступал бы в том же tick()
+            raise ValueError("interval must be positive")
+        return self._add_timer(interval, interval, fn, args)
+
+    def _add_timer(self, delay, interval, fn, args):
+        timer = Timer(self.clock() + delay, interval, fn, args)
+        heapq.heappush(self.timers, (timer.deadline, next(self._seq), timer))
+        return timer
+
+    def animate(self, node, prop, end, duration, easing=ease_in_out, on_done=None,
+                start=None):
+        """Запускает анимацию node.prop к end. Анимация того же свойства
+        того же узла заменяется новой, начиная с текущего значения"""
+        if start is None:
+            start = getattr(node, prop)
+        old_tween = self.tweens.pop((node, prop), None)
+        if old_tween is not None:
+            old_tween.cancel()
+        if duration <= 0:
+            setattr(node, prop, end)
+            if on_done:
+                on_done()
+            return None
+        if self.time is None:
+            self.time = self.clock()
+        tween = Tween(node, prop, start, end, self.time, duration, easing, on_done)
+        self.tweens[(node, prop)] = tween
+        return tween
+
+    def stop(self, node, prop=None):
+        for key in [key for key in self.tweens
+                    if key[0] is node and (prop is None or key[1] == prop)]:
+            self.tweens.pop(key).cancel()
+
+    def tick(self):
+        """Выполняет наступившие таймеры и шаги анимаций.
+        Возвращает True, если что-то выполнилось"""
+        now = self.clock()
+        worked = False
+        while self.timers and self.timers[0][0] <= now:
+            _deadline, _seq, timer = heapq.heappop(self.timers)
+            if timer.cancelled:
+                continue
+            if timer.interval is not None:
+                timer.deadline = max(timer.deadline + timer.interval, now)
+                heapq.heappush(self.timers, (timer.deadline, next(self._seq), timer))
+            timer.fn(*timer.args)
+            worked = True
+
+        if self.tweens:
+            steps = int((now - self.time) / self.step)
+            if steps > MAX_CATCH_UP:
+                # Цикл надолго застрял: не проигрываем пропущенное
+                self.time = now
+            elif steps > 0:
+                self.time += steps * self.step
+            else:
+                return worked
+            for key, tween in list(self.tweens.items()):
+                if tween.done:
+                    self.tweens.pop(key, None)
+                    continue
+                tween.apply(self.time)
+                if tween.done and self.tweens.get(key) is tween:
+                    del self.tweens[key]
+            worked = True
+        if not self.tweens:
+            self.time = None
+        return worked
+
+    def next_deadline(self):
+        """Момент (по clock) следующей работы или None"""
+        deadline = None
+        while self.timers and self.timers[0][2].cancelled:
+            heapq.heappop(self.timers)
+        if self.timers:
+            deadline = self.timers[0][0]
+        if self.tweens:
+            tick = self.time + self.step
+            deadline = tick if deadline is None else min(deadline, tick)
+        return deadline
+
+    def timeout(self, max_timeout):
+        """Сколько миллисекунд циклу можно ждать событий, не больше max_timeout"""
+        deadline = self.next_deadline()
+        if deadline is None:
+            return max_timeout
+        return max(0, min(max_timeout, math.ceil((deadline - self.clock()) * 1000)))
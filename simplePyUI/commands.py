@@ -0,0 +1,74 @@
+import collections
+import concurrent.futures
+import inspect
+import threading
+
+
+def coalesce_key(fn):
+    """Ключ схлопывания: для метода — (объект, функция), иначе сама функция
+    (в том числе встроенные методы вроде list.append)"""
+    if inspect.ismethod(fn):
+        return (fn.__self__, fn.__func__)
+    return fn
+
+
+class CommandQueue:
+    """Вызовы из других потоков, которые поток UI выполняет раз за кадр.
+
+    Очередь защищена одной блокировкой, поток UI забирает её целиком
+    в drain(). Команды с одинаковым ключом (post с coalesce) схлопываются:
+    выполняется только последняя, а её результат получают все futures
+    схлопнутых."""
+
+    def __init__(self, wakeup=None):
+        self.wakeup = wakeup  # Будит цикл UI, вызывается из любого потока
+        self._lock = threading.Lock()
+        self._commands = collections.OrderedDict()  # key -> [fn, args, kwargs, futures]
+
+    def __len__(self):
+        return len(self._commands)
+
+    def put(self, key, fn, args=(), kwargs=None):
+        future = concurrent.futures.Future()
+        with self._lock:
+            was_empty = not self._commands
+            command = self._commands.pop(key, None)
+            futures = command[3] if command else list()
+            futures.append(future)
+            self._commands[key] = [fn, args, kwargs or {}, futures]
+        if was_empty and self.wakeup:
+            self.wakeup()
+        return future
+
+    def call_soon(self, fn, *args, **kwargs):
+        return self.put(object(), fn, args, kwargs)
+
+    def post(self, fn, *args, coalesce=False, **kwargs):
+        """coalesce — True: схлопывать по coalesce_key(fn), другое значение —
+        сам ключ схлопывания. По умолчанию каждый вызов выполняется"""
+        if coalesce is False:
+            return self.call_soon(fn, *args, **kwargs)
+        key = coalesce_key(fn) if coalesce is True else coalesce
+        return self.put(key, fn, args, kwargs)
+
+    def drain(self):
+        """Выполняет накопленные команды. Вызывается только из потока UI"""
+        with self._lock:
+            if not self._commands:
+                return 0
+            commands, self._commands = self._commands, collections.OrderedDict()
+
+        for fn, args, kwargs, futures in commands.values():
+            futures = [future for future in futures
+                       if future.set_running_or_notify_cancel()]
+            if not futures:
+                continue
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as exc:
+                for future in futures:
+                    future.set_exception(exc)
+            else:
+                for future in futures:
+                    future.set_result(result)
+        return len(commands)
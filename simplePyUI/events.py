@@ -0,0 +1,111 @@
+import sdl2
+
+# Поле события с windowID окна, которому оно адресовано
+WINDOW_ID_FIELDS = {
+    sdl2.SDL_WINDOWEVENT: "window",
+    sdl2.SDL_MOUSEMOTION: "motion",
+    sdl2.SDL_MOUSEBUTTONDOWN: "button",
+    sdl2.SDL_MOUSEBUTTONUP: "button",
+    sdl2.SDL_MOUSEWHEEL: "wheel",
+    sdl2.SDL_KEYDOWN: "key",
+    sdl2.SDL_KEYUP: "key",
+    sdl2.SDL_TEXTINPUT: "text",
+    sdl2.SDL_TEXTEDITING: "edit",
+}
+
+
+def route_events(events, window_ids):
+    """Раскладывает события по окнам: {windowID: [события, ...]}.
+    События без окна (SDL_QUIT и пользовательские) получает каждое окно,
+    события неизвестных окон отбрасываются. Порядок событий сохраняется"""
+    routed = {window_id: list() for window_id in window_ids}
+    for event in events:
+        field = WINDOW_ID_FIELDS.get(event.type)
+        if field is None:
+            for window_events in routed.values():
+                window_events.append(event)
+            continue
+        window_events = routed.get(getattr(event, field).windowID)
+        if window_events is not None:
+            window_events.append(event)
+    return routed
+
+
+class EventDispatcher:
+    """Разбирает за кадр всю очередь событий SDL и раздаёт их в Render.
+
+    Подряд идущие SDL_MOUSEMOTION схлопываются в одно обновление hover/drag
+    по последней позиции, подряд идущие SDL_MOUSEWHEEL — в одну прокрутку
+    с суммой смещений. Накопленное движение отдаётся перед любым другим
+    событием, поэтому клик всегда приходит в ту точку, где он был сделан."""
+
+    def __init__(self, render, ignore_types=()):
+        self.render = render
+        self.ignore_types = frozenset(ignore_types)
+        self.quit = False
+        self._motion = None  # Последняя позиция курсора в серии движений
+        self._wheel = None  # Сумма прокрутки в серии
+
+    def dispatch(self, events):
+        """Обрабатывает events целиком. False, если пришёл SDL_QUIT
+        или окно закрывают"""
+        for event in events:
+            event_type = event.type
+            if event_type == sdl2.SDL_MOUSEMOTION:
+                self._flush_wheel()
+                self._motion = (event.motion.x, event.motion.y)
+                continue
+            if event_type == sdl2.SDL_MOUSEWHEEL:
+                self._flush_motion()
+                self._add_wheel(event.wheel)
+                continue
+            if event_type in self.ignore_types:
+                continue
+            self._flush()
+
+            if event_type == sdl2.SDL_QUIT:
+                self.quit = True
+            elif event_type == sdl2.SDL_WINDOWEVENT:
+                if event.window.event == sdl2.SDL_WINDOWEVENT_LEAVE:
+                    self.render.mouse_leave()
+                elif event.window.event == sdl2.SDL_WINDOWEVENT_CLOSE:
+                    self.quit = True
+                self.render.redraw_all = True
+            elif event_type == sdl2.SDL_MOUSEBUTTONDOWN:
+                self.render.mouse_down((event.button.x, event.button.y))
+            elif event_type == sdl2.SDL_MOUSEBUTTONUP:
+                self.render.mouse_up((event.button.x, event.button.y))
+            elif event_type == sdl2.SDL_KEYDOWN:
+                keysym = event.key.keysym
+                self.render.key_down(keysym.sym, keysym.mod)
+            elif event_type == sdl2.SDL_KEYUP:
+                keysym = event.key.keysym
+                self.render.key_up(keysym.sym, keysym.mod)
+            elif event_type == sdl2.SDL_TEXTINPUT:
+                self.render.text_input(event.text.text.decode("utf-8"))
+        self._flush()
+        return not self.quit
+
+    def _add_wheel(self, wheel):
+        wheel_x, wheel_y = wheel.x, wheel.y
+        if wheel.direction == sdl2.SDL_MOUSEWHEEL_FLIPPED:
+            wheel_x, wheel_y = -wheel_x, -wheel_y
+        if self._wheel is not None:
+            wheel_x += self._wheel[0]
+            wheel_y += self._wheel[1]
+        self._wheel = (wheel_x, wheel_y)
+
+    def _flush_motion(self):
+        if self._motion is not None:
+            pos, self._motion = self._motion, None
+            self.render.mouse_motion(pos)
+
+    def _flush_wheel(self):
+        if self._wheel is not None:
+            (wheel_x, wheel_y), self._wheel = self._wheel, None
+            if wheel_x or wheel_y:
+                self.render.mouse_wheel(wheel_x, wheel_y)
+
+    def _flush(self):
+        self._flush_motion()
+        self._flush_wheel()
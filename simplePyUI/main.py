@@ -1,7 +1,13 @@
 import abc
+import asyncio
 import ctypes
 import enum
+import functools
+import inspect
+import itertools
+import pickle
 import time
+import warnings
 
 import threading
 
@@ -10,8 +16,21 @@ import sdl2.ext
 import sdl2.sdlttf
 
 from . import abstarct_classes
+from .animation import FPS, Scheduler
+from .commands import CommandQueue
+from .events import EventDispatcher, route_events
+from .pool import POOL_BYTES, SurfacePool
+from .profiler import FrameProfiler
+from .raster import ASYNC_FILL_PIXELS, Rasterizer, fill_surface, rasterize_text
+from .spatial import HitGrid
+from .text import GlyphFontManager
 
 TIME_TO_CLICK = 0.9
+DRAG_THRESHOLD = 4  # px от точки нажатия до начала прокрутки перетаскиванием
+EMPTY_RECT = (0, 0, 0, 0)
+IDLE_TIMEOUT = 50  # мс ожидания событий, когда перерисовывать нечего
+MAX_DIRTY_RECTS = 16  # Больше областей перерисовки сводятся в одну общую
+KEY_EVENTS = ("key_down", "key_up", "text_input")
 
 
 class ALIGN(enum.IntEnum):
@@ -23,97 +42,810 @@ class ALIGN(enum.IntEnum):
     VCENTER = 32
 
 
+def _union_rect(rect_a, rect_b):
+    if not rect_a:
+        return rect_b
+    if not rect_b:
+        return rect_a
+    x = min(rect_a[0], rect_b[0])
+    y = min(rect_a[1], rect_b[1])
+    w = max(rect_a[0] + rect_a[2], rect_b[0] + rect_b[2]) - x
+    h = max(rect_a[1] + rect_a[3], rect_b[1] + rect_b[3]) - y
+    return (x, y, w, h)
+
+
+def _clip_rect(rect, clip):
+    x = max(rect[0], clip[0])
+    y = max(rect[1], clip[1])
+    w = min(rect[0] + rect[2], clip[0] + clip[2]) - x
+    h = min(rect[1] + rect[3], clip[1] + clip[3]) - y
+    if w <= 0 or h <= 0:
+        return None
+    return (x, y, w, h)
+
+
+def _merge_rects(rects):
+    merged = list()
+    for rect in rects:
+        i = 0
+        while i < len(merged):
+            if _clip_rect(merged[i], rect):
+                rect = _union_rect(merged.pop(i), rect)
+                i = 0
+            else:
+                i += 1
+        merged.append(rect)
+    return merged
+
+
+class FillSprite(sdl2.ext.Sprite):
+    """Сплошная заливка для TEXTURE-рендера: рисуется SDL_RenderFillRect,
+    текстура под неё не создаётся"""
+
+    def __init__(self, size, color):
+        super().__init__()
+        self._size = tuple(size)
+        self.color = sdl2.ext.convert_to_color(color)
+
+    @property
+    def size(self):
+        return self._size
+
+
 class Render:
 
-    def __init__(self, sdl_window, start_ui_node, font_path):
+    def __init__(self, sdl_window, start_ui_node, font_path,
+                 sprite_type=sdl2.ext.SOFTWARE, vsync=False, pool_bytes=POOL_BYTES,
+                 hit_grid=None, font_manager=None, surface_pool=None, rasterizer=None):
+        """sprite_type = sdl2.ext.SOFTWARE | sdl2.ext.TEXTURE
+        vsync — SDL_RenderPresent ждёт обратного хода луча (только TEXTURE)
+        pool_bytes — потолок памяти свободных спрайтов в surface_pool
+        hit_grid — HitGrid уже разложенного дерева (из snapshot.load)
+        font_manager, surface_pool — общие с другими окнами (UIApp),
+        по умолчанию у Render свои
+        rasterizer — raster.Rasterizer: изменившиеся надписи и большие
+        заливки растеризуются в его потоках, пока на экране старые"""
 
         self.sdl_window = sdl_window
         self.start_ui_node = start_ui_node
+        self.font_path = font_path
 
-        self.sprite_factory = sdl2.ext.SpriteFactory(sdl2.ext.SOFTWARE)
+        self.renderer = None
+        self.vsync = False
+        if sprite_type == sdl2.ext.TEXTURE:
+            self.renderer = self._create_renderer(sdl_window, vsync)
+            self.vsync = vsync
+        self.sprite_factory = sdl2.ext.SpriteFactory(
+            sprite_type, renderer=self.renderer)
         self.sprite_renderer = self.sprite_factory.create_sprite_render_system(
             sdl_window)
-        self.font_manager = sdl2.ext.FontManager(font_path)
+        self.font_manager = font_manager or GlyphFontManager(font_path)
+        self.surface_pool = surface_pool or SurfacePool(self.renderer, pool_bytes)
 
         self.click_timer = float()
         self.selected_node = None
         self.last_mouse_pos = None
+        self.dragging = False  # Идёт перетаскивание: отпускание не считается кликом
+        self.mouse_pos = (0, 0)
+        self.focused_node = None  # Получатель событий клавиатуры
+        self.hovered_path = list()  # Узлы с hover под курсором, от верхнего к корню
+
+        self.sprites_to_render = list()
+        self.sprite_clips = list()  # Область отсечения для каждого спрайта
+        self.dirty_rects = list()
+        self.redraw_all = True
+        self.hit_grid = hit_grid if hit_grid is not None else HitGrid()
+        self.registry = NodeRegistry()
+        self.registry.attach(start_ui_node)
+        self.profiler = None  # FrameProfiler, подключается через его attach()
+        self.run_coroutine = None  # fun(coroutine) для обработчиков-корутин, см. SimpleUI.run_async
+        self.rasterizer = rasterizer
+
+    @staticmethod
+    def _create_renderer(sdl_window, vsync=False):
+        flags = sdl2.SDL_RENDERER_PRESENTVSYNC if vsync else 0
+        try:
+            return sdl2.ext.Renderer(
+                sdl_window, flags=sdl2.SDL_RENDERER_ACCELERATED | flags)
+        except sdl2.ext.SDLError:
+            # Нет GPU (или video driver dummy): программный рендер SDL
+            return sdl2.ext.Renderer(
+                sdl_window, flags=sdl2.SDL_RENDERER_SOFTWARE | flags)
+
+    def refresh_rate(self):
+        """Частота обновления дисплея окна в Гц, 0 если неизвестна"""
+        mode = sdl2.SDL_DisplayMode()
+        display = sdl2.SDL_GetWindowDisplayIndex(self.sdl_window.window)
+        if display < 0 or sdl2.SDL_GetCurrentDisplayMode(display, mode) != 0:
+            return 0
+        return mode.refresh_rate
+
+    def is_dirty(self):
+        return self.redraw_all or self.start_ui_node._dirty or \
+            self.start_ui_node._child_dirty
 
     def draw(self):
+        """Перерисовывает только изменившиеся области окна.
+        Возвращает False, если перерисовывать было нечего"""
+        rasterizer = self.rasterizer
+        if rasterizer is not None:
+            # Граница кадра: готовые в потоках картинки заменяют старые
+            if self.profiler is None:
+                rasterizer.swap(self)
+            else:
+                self.profiler.timed("rasterize", rasterizer.swap, self)
+        if not self.is_dirty():
+            return False
+
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.start_frame()
+        self.layout()
+        if profiler is not None:
+            profiler.mark("layout")
         self.sprites_to_render = list()
-        self.start_ui_node.get_sprites(self, (0, 0))
-        self.sprite_renderer.render(self.sprites_to_render)
+        self.sprite_clips = list()
+        self.dirty_rects = list()
+        window_rect = (0, 0) + tuple(self.sdl_window.size)
+        self.start_ui_node.get_sprites(self, window_rect)
+        if rasterizer is not None:
+            # Потоки растеризуют, пока кадр выводится на экран
+            rasterizer.flush()
+        if profiler is not None:
+            profiler.mark("collect")
+
+        if self.renderer:
+            # Содержимое заднего буфера после SDL_RenderPresent не определено,
+            # поэтому кадр с изменениями рисуется целиком
+            self._render_textures()
+        else:
+            if self.redraw_all:
+                rects = [window_rect]
+            else:
+                rects = (_clip_rect(rect, window_rect) for rect in self.dirty_rects)
+                rects = [rect for rect in rects if rect]
+                if len(rects) > MAX_DIRTY_RECTS:
+                    # Каждая область проверяет все спрайты кадра, а слияние
+                    # квадратично: при сотнях изменившихся узлов одна общая
+                    # область дешевле
+                    rects = [functools.reduce(_union_rect, rects)]
+                else:
+                    rects = _merge_rects(rects)
+            if rects:
+                self._blit(rects)
+        self.redraw_all = False
+        if profiler is not None:
+            profiler.mark("blit")
+            profiler.end_frame()
+        return True
+
+    def _blit(self, rects):
+        surface = self.sdl_window.get_surface()
+        sdl_rects = (sdl2.SDL_Rect * len(rects))(
+            *(sdl2.SDL_Rect(*rect) for rect in rects))
+        dst = sdl2.SDL_Rect()
+        for rect, sdl_rect in zip(rects, sdl_rects):
+            sdl2.SDL_SetClipRect(surface, sdl_rect)
+            sdl2.SDL_FillRect(surface, sdl_rect, 0)
+            last_area = rect
+            for sprite, clip in zip(self.sprites_to_render, self.sprite_clips):
+                area = _clip_rect(rect, clip)
+                if not area or not _clip_rect(sprite.position + sprite.size, area):
+                    continue
+                if area != last_area:
+                    sdl2.SDL_SetClipRect(surface, sdl2.SDL_Rect(*area))
+                    last_area = area
+                dst.x, dst.y = sprite.position
+                sdl2.SDL_BlitSurface(sprite.surface, None, surface, dst)
+        sdl2.SDL_SetClipRect(surface, None)
+        sdl2.SDL_UpdateWindowSurfaceRects(
+            self.sdl_window.window, sdl_rects, len(rects))
+
+    def _render_textures(self):
+        renderer = self.renderer.sdlrenderer
+        sdl2.SDL_SetRenderDrawColor(renderer, 0, 0, 0, 255)
+        sdl2.SDL_RenderClear(renderer)
+        self._copy_textures(renderer, self.sprites_to_render, self.sprite_clips)
+        sdl2.SDL_RenderPresent(renderer)
+
+    @staticmethod
+    def _copy_textures(renderer, sprites, clips, origin=(0, 0)):
+        """Рисует спрайты в текущую цель renderer, сдвинув их на -origin"""
+        ox, oy = origin
+        dst = sdl2.SDL_Rect()
+        last_clip = None
+        for sprite, clip in zip(sprites, clips):
+            if clip != last_clip:
+                sdl2.SDL_RenderSetClipRect(renderer, sdl2.SDL_Rect(
+                    clip[0] - ox, clip[1] - oy, clip[2], clip[3]))
+                last_clip = clip
+            dst.x, dst.y = sprite.position[0] - ox, sprite.position[1] - oy
+            dst.w, dst.h = sprite.size
+            if isinstance(sprite, FillSprite):
+                color = sprite.color
+                sdl2.SDL_SetRenderDrawColor(
+                    renderer, color.r, color.g, color.b, color.a)
+                sdl2.SDL_RenderFillRect(renderer, dst)
+            else:
+                sdl2.SDL_RenderCopy(renderer, sprite.texture, None, dst)
+        sdl2.SDL_RenderSetClipRect(renderer, None)
+
+    def flatten(self, sprites, clips, area, layer=None):
+        """Сводит спрайты в один спрайт-слой размером с area (окно).
+        layer — прошлый слой узла, переиспользуется при том же размере"""
+        x, y, w, h = area
+        if layer is None or tuple(layer.size) != (w, h):
+            if layer is not None:
+                self.surface_pool.release((layer,))
+            layer = self._create_layer(w, h)
+        if self.renderer:
+            renderer = self.renderer.sdlrenderer
+            sdl2.SDL_SetRenderTarget(renderer, layer.texture)
+            sdl2.SDL_SetRenderDrawColor(renderer, 0, 0, 0, 0)
+            sdl2.SDL_RenderClear(renderer)
+            self._copy_textures(renderer, sprites, clips, (x, y))
+            sdl2.SDL_SetRenderTarget(renderer, None)
+        else:
+            surface = layer.surface
+            sdl2.SDL_FillRect(surface, None, 0)
+            dst = sdl2.SDL_Rect()
+            for sprite, clip in zip(sprites, clips):
+                clip = _clip_rect(clip, area)
+                if not clip:
+                    continue
+                sdl2.SDL_SetClipRect(surface, sdl2.SDL_Rect(
+                    clip[0] - x, clip[1] - y, clip[2], clip[3]))
+                dst.x, dst.y = sprite.position[0] - x, sprite.position[1] - y
+                sdl2.SDL_BlitSurface(sprite.surface, None, surface, dst)
+            sdl2.SDL_SetClipRect(surface, None)
+        layer.position = (x, y)
+        return layer
+
+    def _create_layer(self, w, h):
+        if self.renderer:
+            return self.surface_pool.texture(
+                w, h, sdl2.SDL_TEXTUREACCESS_TARGET, self.renderer)
+        return self.surface_pool.surface(w, h)
+
+    def layout(self):
+        """Пересчитывает абсолютные позиции поддеревьев, у которых поменялись
+        pos, size, align или состав, и обновляет hit_grid"""
+        root = self.start_ui_node
+        if root._layout_dirty:
+            root.layout(root.calc_pos((0, 0)), self.hit_grid)
+        elif root._child_layout_dirty:
+            root.update_layout(self.hit_grid)
+
+    def hit_test(self, pos_mouse):
+        """Верхний кликабельный узел под курсором. Тот же узел находит обход
+        start_ui_node.get_hovered_node, но без обхода всего дерева"""
+        self.layout()
+        return self.hit_grid.query(pos_mouse)
+
+    def call_handler(self, handler, *args):
+        """Вызывает обработчик события. Если он вернул корутину
+        (async def click_event), она отдаётся в run_coroutine"""
+        result = handler(*args)
+        if result is not None and inspect.isawaitable(result):
+            if self.run_coroutine is None:
+                if inspect.iscoroutine(result):
+                    result.close()
+                raise TypeError("%r returned an awaitable: coroutine handlers "
+                                "need SimpleUI.run_async" % (handler,))
+            self.run_coroutine(result)
+        return result
+
+    def handle_mouse_event(self, pos_mouse, event, *args):
+        node = self.hit_test(pos_mouse)
+        if node is not None and hasattr(node, event):
+            if node.pass_mouse_pos:
+                args = (pos_mouse,) + args
+            self.call_handler(getattr(node, event), *args)
+        return node
+
+    @staticmethod
+    def find_handler(node, event):
+        """Ближайший к node предок (или сам node), у которого есть обработчик event"""
+        while node is not None and not hasattr(node, event):
+            node = node.parent
+        return node
 
     def mouse_down(self, pos_click):
+        self.mouse_pos = pos_click
         self.click_timer = time.time()
         self.last_mouse_pos = pos_click
-        self.selected_node = self.start_ui_node.handle_mouse_event(
-            pos_click, (0, 0), "mouse_down")
+        self.dragging = False
+        self.selected_node = self.handle_mouse_event(pos_click, "mouse_down")
+        self.set_focus(self.find_focusable(self.selected_node))
 
     def mouse_up(self, pos_click):
+        self.mouse_pos = pos_click
         self.selected_node = None
-        if (time.time() - self.click_timer < TIME_TO_CLICK):
-            self.start_ui_node.handle_mouse_event(
-                pos_click, (0, 0), "mouse_click")
+        if (time.time() - self.click_timer < TIME_TO_CLICK) and not self.dragging:
+            self.handle_mouse_event(pos_click, "mouse_click")
+        self.dragging = False
         self.click_timer = float()
-        self.start_ui_node.handle_mouse_event(pos_click, (0, 0), "mouse_up")
+        self.handle_mouse_event(pos_click, "mouse_up")
 
     def mouse_hover(self, pos_mouse):
-        nodes_with = list()
-        self.start_ui_node.get_nodes_with(nodes_with, "hover")
-        hovered_node = self.start_ui_node.get_hovered_node(pos_mouse, (0, 0))
-        if hovered_node in nodes_with:
-            nodes_with.remove(hovered_node)
-            hovered_node.hover[0]()
-        for node in nodes_with:
-            node.hover[1]()
+        """hover = (mouse_in, mouse_out) вызываются только при входе курсора
+        в узел и выходе из него. Узел считается под курсором, пока курсор
+        над ним или над любым его потомком"""
+        self.mouse_pos = pos_mouse
+        hoverable = self.registry.hoverable
+        if not hoverable and not self.hovered_path:
+            return
+        path = list()
+        node = self.hit_test(pos_mouse)
+        while node is not None:
+            if node in hoverable:
+                path.append(node)
+            node = node.parent
+        self.set_hovered_path(path)
+
+    def mouse_leave(self):
+        """Курсор ушёл из окна"""
+        self.set_hovered_path(list())
+
+    def set_hovered_path(self, path):
+        old_path = self.hovered_path
+        if path == old_path:
+            return
+        self.hovered_path = path
+        entered = set(path)
+        for node in old_path:
+            if node not in entered:
+                self.call_handler(node.hover[1])
+        left = set(old_path)
+        for node in reversed(path):
+            if node not in left:
+                self.call_handler(node.hover[0])
 
     def mouse_drag(self, pos_mouse):
             pos_mouse_dff = (pos_mouse[0] - self.last_mouse_pos[0] , pos_mouse[1] - self.last_mouse_pos[1])
             self.last_mouse_pos = pos_mouse
-            getattr(self.selected_node, "mouse_drag", lambda x,_y: x)(pos_mouse, pos_mouse_dff)
-
-    def _all_nodes_thrunking(self):
-        res = list()
-        res.extend(self.start_ui_node.nodes)
-        for node in res:
-            yield node
-            res.extend(node.nodes)
-        return res
+            node = self.find_handler(self.selected_node, "mouse_drag")
+            if node is not None:
+                self.call_handler(node.mouse_drag, pos_mouse, pos_mouse_dff)
+
+    def mouse_motion(self, pos_mouse):
+        self.mouse_hover(pos_mouse)
+        if not self.selected_node:
+            return
+        if not self.dragging:
+            node = self.find_handler(self.selected_node, "mouse_drag")
+            if node is not None and node.drag_scrolls:
+                # Прокрутка идёт за курсором от точки нажатия (last_mouse_pos)
+                x, y = self.last_mouse_pos
+                if max(abs(pos_mouse[0] - x), abs(pos_mouse[1] - y)) < DRAG_THRESHOLD:
+                    return
+            elif time.time() - self.click_timer > TIME_TO_CLICK:
+                # Перетаскивание после удержания начинается с текущей точки:
+                # сдвиг курсора за время удержания не применяется
+                self.last_mouse_pos = pos_mouse
+            else:
+                return
+            self.dragging = True
+        self.mouse_drag(pos_mouse)
+
+    def mouse_wheel(self, wheel_x, wheel_y):
+        node = self.find_handler(self.hit_test(self.mouse_pos), "mouse_wheel")
+        if node is not None:
+            self.call_handler(node.mouse_wheel, wheel_x, wheel_y)
+
+    @staticmethod
+    def find_focusable(node):
+        """Ближайший к node предок (или сам node), принимающий клавиатуру"""
+        while node is not None and not any(
+                hasattr(node, event) for event in KEY_EVENTS):
+            node = node.parent
+        return node
+
+    def set_focus(self, node):
+        if node is self.focused_node:
+            return
+        old_node, self.focused_node = self.focused_node, node
+        if old_node is not None and hasattr(old_node, "focus_out"):
+            self.call_handler(old_node.focus_out)
+        if node is not None and hasattr(node, "focus_in"):
+            self.call_handler(node.focus_in)
+
+    def handle_key_event(self, event, *args):
+        """Отдаёт событие клавиатуры узлу в фокусе, поднимаясь по родителям"""
+        node = self.focused_node
+        if node is not None and node._registry is not self.registry:
+            # Узел в фокусе убрали из дерева
+            self.set_focus(None)
+            node = None
+        node = self.find_handler(node or self.start_ui_node, event)
+        if node is not None:
+            self.call_handler(getattr(node, event), *args)
+        return node
+
+    def key_down(self, key, mod):
+        self.handle_key_event("key_down", key, mod)
+
+    def key_up(self, key, mod):
+        self.handle_key_event("key_up", key, mod)
+
+    def text_input(self, text):
+        self.handle_key_event("text_input", text)
 
     def get_node_by_name(self, name):
-        for node in self._all_nodes_thrunking():
-            s_id = getattr(node, "s_id", None)
-            if s_id and s_id == name:
-                return node
+        return self.registry.get(name)
 
     def remove_node_by_name(self, name):
-        res = list()
-        res.extend(self.start_ui_node.nodes)
-        for node in res:
-            for child_node in node.nodes:
-                s_id = getattr(child_node, "s_id", None)
-                if s_id and s_id == name:
-                    node.nodes.remove(child_node)
-                    return
-            res.extend(node.nodes)
-
-
-class UINode(metaclass=abc.ABCMeta):
+        """Убирает узел из родителя. False, если узла нет или это корень"""
+        node = self.registry.get(name)
+        if node is None or node.parent is None:
+            return False
+        node.parent.nodes.remove(node)
+        return True
+
+    def close(self):
+        """Возвращает спрайты дерева в пул и уничтожает renderer.
+        Текстуры должны освободиться раньше своего renderer, поэтому
+        close() вызывается до закрытия окна"""
+        stack = [self.start_ui_node]
+        while stack:
+            node = stack.pop()
+            for sprites in (node._sprites, node._stale_sprites):
+                if sprites:
+                    self.surface_pool.release(sprites)
+            if node._layer is not None:
+                self.surface_pool.release((node._layer,))
+            node._sprites = node._stale_sprites = None
+            node._layer = node._layer_key = node._drawn_bounds = None
+            node._dirty = node._child_dirty = True
+            stack.extend(node.nodes)
+        self.sprites_to_render = list()
+        self.sprite_clips = list()
+        self.registry.detach(self.start_ui_node)
+        if self.rasterizer is not None:
+            self.rasterizer.forget(self)
+        if self.renderer:
+            self.surface_pool.forget(self.renderer)
+            self.renderer.destroy()
+            self.renderer = None
+
+
+class NodeRegistry:
+    """Индекс s_id -> узлы дерева, подключённого к Render.
+
+    Поддерживается NodeList и UINode.__setattr__ при каждом изменении
+    детей, поэтому поиск по имени не обходит дерево. Родитель узла —
+    node.parent. При одинаковых s_id возвращается подключённый раньше."""
+
+    def __init__(self):
+        self.names = dict()  # s_id -> [node, ...]
+        self.hoverable = set()  # Узлы с обработчиками hover
+
+    def __len__(self):
+        return len(self.names)
+
+    def get(self, s_id):
+        nodes = self.names.get(s_id)
+        return nodes[0] if nodes else None
+
+    def attach(self, node):
+        """Регистрирует узел и всё его поддерево"""
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node._registry is self:
+                continue
+            node._registry = self
+            if node.s_id:
+                self.names.setdefault(node.s_id, list()).append(node)
+            if hasattr(node, "hover"):
+                self.hoverable.add(node)
+            stack.extend(node.nodes)
+
+    def detach(self, node):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node._registry is not self:
+                continue
+            node._registry = None
+            if node.s_id:
+                self._forget(node.s_id, node)
+            self.hoverable.discard(node)
+            stack.extend(node.nodes)
+
+    def rename(self, node, old_s_id, new_s_id):
+        if old_s_id:
+            self._forget(old_s_id, node)
+        if new_s_id:
+            self.names.setdefault(new_s_id, list()).append(node)
+
+    def _forget(self, s_id, node):
+        nodes = self.names.get(s_id, ())
+        for i, named in enumerate(nodes):
+            if named is node:
+                del nodes[i]
+                break
+        if not nodes:
+            self.names.pop(s_id, None)
+
+
+class NodeList(list):
+    """Список дочерних узлов, сообщающий владельцу о своих изменениях"""
+
+    __slots__ = ("owner",)
+
+    def __init__(self, owner, nodes=()):
+        super().__init__(nodes)
+        self.owner = owner
+        for node in self:
+            node.parent = owner
+
+    def _added(self, nodes):
+        registry = self.owner._registry
+        for node in nodes:
+            node.parent = self.owner
+            if registry is not None:
+                registry.attach(node)
+        self.owner.mark_dirty(layout=True)
+
+    def _removed(self, nodes):
+        for node in nodes:
+            if node.parent is self.owner:
+                node.parent = None
+                self.owner._forget_child(node)
+                if node._registry is not None:
+                    node._registry.detach(node)
+        self.owner.mark_dirty(layout=True)
+
+    def append(self, node):
+        super().append(node)
+        self._added((node,))
+
+    def extend(self, nodes):
+        nodes = list(nodes)
+        super().extend(nodes)
+        self._added(nodes)
+
+    def __iadd__(self, nodes):
+        self.extend(nodes)
+        return self
+
+    def insert(self, index, node):
+        super().insert(index, node)
+        self._added((node,))
+
+    def remove(self, node):
+        super().remove(node)
+        self._removed((node,))
+
+    def pop(self, index=-1):
+        node = super().pop(index)
+        self._removed((node,))
+        return node
+
+    def clear(self):
+        nodes = list(self)
+        super().clear()
+        self._removed(nodes)
+
+    def __setitem__(self, index, val):
+        old = self[index]
+        if isinstance(index, slice):
+            val = list(val)
+        super().__setitem__(index, val)
+        if isinstance(index, slice):
+            self._removed(old)
+            self._added(val)
+        else:
+            self._removed((old,))
+            self._added((val,))
+
+    def __delitem__(self, index):
+        old = self[index]
+        super().__delitem__(index)
+        self._removed(old if isinstance(index, slice) else (old,))
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self.owner.mark_dirty(layout=True)
+
+    def reverse(self):
+        super().reverse()
+        self.owner.mark_dirty(layout=True)
+
+
+class NodeMeta(abc.ABCMeta):
+    """Разрешает задавать значения по умолчанию для полей из __slots__
+    обычными атрибутами класса, как у остальных свойств узлов.
+
+    Такие атрибуты убираются из класса (иначе они конфликтуют со слотами)
+    и попадают в _defaults, которые UINode.__init__ записывает в слоты
+    каждого нового узла. Переопределение в наследнике поля, объявленного
+    слотом у предка, тоже становится значением по умолчанию."""
+
+    def __new__(mcls, name, bases, namespace, **kwargs):
+        slots = set(namespace.get("__slots__", ()))
+        for base in bases:
+            for klass in base.__mro__:
+                slots.update(klass.__dict__.get("__slots__", ()))
+        slots -= {"__dict__", "__weakref__"}
+
+        defaults = dict()
+        for base in reversed(bases):
+            defaults.update(getattr(base, "_defaults", {}))
+        for key in [key for key in namespace if key in slots]:
+            defaults[key] = namespace.pop(key)
+        namespace["_defaults"] = defaults
+        namespace["_slots"] = tuple(sorted(slots))
+        return super().__new__(mcls, name, bases, namespace, **kwargs)
+
+
+class UINode(metaclass=NodeMeta):
+    """Базовый узел дерева.
+
+    Часто меняющиеся поля объявлены в __slots__, поэтому у узла нет
+    __dict__, пока ему не присвоят что-то необъявленное (обработчики
+    событий, пользовательские свойства из kwargs). Поля со значениями
+    по умолчанию задаются атрибутами класса, см. NodeMeta"""
+
+    __slots__ = ("pos", "size", "nodes", "parent", "s_id", "abs_pos",
+                 "_sprites", "_dirty", "_child_dirty", "_layout_dirty",
+                 "_child_layout_dirty", "_hit_key", "_clip", "_layout_bounds",
+                 "_drawn_bounds", "_registry", "_removed_nodes",
+                 "cache_subtree", "_layer", "_layer_key", "_stale_sprites",
+                 "_damage", "__dict__", "__weakref__")
 
     clickable = True  # Перехватывать события мыши
+    clip = False  # Обрезать детей по своим границам
+    cache_subtree = False  # Рисовать поддерево одним слоем, см. _get_layer_sprites
+    pass_mouse_pos = False  # Передавать в mouse_down/up/click позицию курсора
+    # mouse_drag прокручивает содержимое: перетаскивание начинается сразу
+    # после DRAG_THRESHOLD, без удержания кнопки TIME_TO_CLICK
+    drag_scrolls = False
     align = ALIGN.LEFT | ALIGN.TOP
+    sprite_props = frozenset()  # Свойства, от которых зависит картинка узла
+    redraw_props = frozenset(("pos", "size", "align", "color", "text", "text_size",
+                              "text_align", "font", "sprite", "nodes",
+                              "cache_subtree"))
+    layout_props = frozenset(("pos", "size", "align", "nodes", "clickable", "clip"))
+    layout_depends_on_children = False  # Раскладка детей зависит от их размеров
+    # Поля, которые не сохраняются в снимок (snapshot.py) и считаются заново.
+    # Раскладка сохраняется вместе с Render.hit_grid
+    snapshot_skip = frozenset((
+        "parent", "_sprites", "_dirty", "_child_dirty", "_drawn_bounds",
+        "_registry", "_removed_nodes", "_layer", "_layer_key", "_stale_sprites",
+        "_damage"))
+    parent = None
+    s_id = None  # Имя узла для SimpleUI.get_node_by_name
+    abs_pos = None  # Абсолютная позиция, посчитанная в layout()
+
+    _sprites = None
+    _dirty = True  # Узел изменился после последней отрисовки
+    _child_dirty = True  # Изменилось что-то в поддереве
+    _layout_dirty = True  # Поменялось положение, размер или состав узла
+    _child_layout_dirty = True
+    _hit_key = ()  # Путь от корня, порядок узла в hit_grid
+    _clip = None  # Область отсечения, доставшаяся от предков
+    _layout_bounds = None  # Область, занятая поддеревом после layout()
+    _drawn_bounds = None  # Область окна, занятая поддеревом при отрисовке
+    _registry = None  # NodeRegistry дерева, к которому подключён узел
+    _removed_nodes = None  # Отцепленные дети, которых ещё надо убрать из hit_grid
+    _layer = None  # Спрайт-слой поддерева при cache_subtree
+    _layer_key = None  # Положение области слоя относительно abs_pos и её размер
+    _stale_sprites = None  # Старые спрайты, которые вернутся в Render.surface_pool
+    _damage = None  # Изменившаяся часть картинки (x, y, w, h) от abs_pos, см. mark_damaged
 
     def __init__(self, pos, size, nodes=None, **kwargs):
-        self.pos = pos
-        self.size = size
-
-        self.nodes = nodes
-        if nodes == None:
-            self.nodes = list()
+        # Новый узел и так целиком грязный и ни к чему не подключён,
+        # поэтому поля пишутся мимо __setattr__ без mark_dirty
+        set_field = object.__setattr__
+        for key, val in self._defaults.items():
+            set_field(self, key, val)
+        set_field(self, "pos", pos)
+        set_field(self, "size", size)
+        set_field(self, "nodes", NodeList(self, nodes or ()))
 
         for key, val in kwargs.items():
-            setattr(self, key, val)
+            set_field(self, key, val)
+
+    def __setattr__(self, key, val):
+        if key not in self.redraw_props and key not in self.layout_props:
+            if key == "s_id" and self._registry is not None:
+                self._registry.rename(self, self.s_id, val)
+            super().__setattr__(key, val)
+            if key == "hover" and self._registry is not None:
+                self._registry.hoverable.add(self)
+            return
+        if key == "nodes" and val is not None:
+            old_nodes = getattr(self, "nodes", None) or ()
+            val = NodeList(self, val)
+            self._replace_nodes(old_nodes, val)
+        elif getattr(self, key, None) == val:
+            # Значение не поменялось: не трогаем кэш и не перерисовываем
+            super().__setattr__(key, val)
+            return
+        super().__setattr__(key, val)
+        if key in self.sprite_props:
+            self.invalidate_sprites()
+        self.mark_dirty(key in self.layout_props)
+
+    def __getstate__(self):
+        """Поля узла для pickle (снимок дерева, см. snapshot.py).
+        Поля со значением по умолчанию не сохраняются"""
+        state = dict()
+        defaults = self._defaults
+        for key in self._slots:
+            if key in self.snapshot_skip:
+                continue
+            val = getattr(self, key, defaults.get(key))
+            if key not in defaults or val is not defaults[key]:
+                state[key] = val
+        state.update(getattr(self, "__dict__", ()))
+        state["nodes"] = list(self.nodes)
+        return state
+
+    def __setstate__(self, state):
+        # Загруженный узел целиком грязный и ни к чему не подключён, как новый
+        set_field = object.__setattr__
+        for key, val in self._defaults.items():
+            set_field(self, key, val)
+        nodes = state.pop("nodes", ())
+        for key, val in state.items():
+            set_field(self, key, val)
+        set_field(self, "nodes", NodeList(self, nodes))
+
+    def _replace_nodes(self, old_nodes, new_nodes):
+        # Оставшиеся в новом списке узлы не переподключаем
+        kept = set(new_nodes)
+        for node in old_nodes:
+            if node not in kept and node.parent is self:
+                node.parent = None
+                self._forget_child(node)
+                if node._registry is not None:
+                    node._registry.detach(node)
+        if self._registry is not None:
+            old_nodes = set(old_nodes)
+            for node in new_nodes:
+                if node not in old_nodes:
+                    self._registry.attach(node)
+
+    def _forget_child(self, node):
+        if self._removed_nodes is None:
+            self._removed_nodes = list()
+        self._removed_nodes.append(node)
+
+    def invalidate_sprites(self):
+        # Спрайты возвращаются в пул при следующем сборе кадра:
+        # узел не знает, к какому Render подключён
+        if self._sprites is not None:
+            self._stale_sprites = self._sprites
+        self._sprites = None
+
+    def mark_dirty(self, layout=False):
+        self._dirty = True
+        if layout:
+            self._layout_dirty = True
+            if self.parent is not None and self.parent.layout_depends_on_children:
+                self.parent.mark_dirty(layout=True)
+        node = self.parent
+        while node is not None and not (
+                node._child_dirty and (node._child_layout_dirty or not layout)):
+            node._child_dirty = True
+            if layout:
+                node._child_layout_dirty = True
+            node = node.parent
+
+    def mark_damaged(self, rect):
+        """Перерисовать только часть rect = (x, y, w, h) картинки узла,
+        в координатах узла. Если узел и так перерисовывается целиком,
+        область ничего не добавляет"""
+        self._damage = _union_rect(self._damage, tuple(rect))
+        # Слой cache_subtree пересобирается по _child_dirty
+        self._child_dirty = True
+        node = self.parent
+        while node is not None and not node._child_dirty:
+            node._child_dirty = True
+            node = node.parent
 
     def calc_pos(self, pos_off):
         return (self.pos[0] + pos_off[0], self.pos[1] + pos_off[1])
@@ -135,32 +867,186 @@ class UINode(metaclass=abc.ABCMeta):
 
         return pos_off
 
-    def get_sprites(self, render: Render, pos_off):
-        pos_off = self.calc_pos(pos_off)
-        render.sprites_to_render.extend(self.create_sprites(render, pos_off))
+    def place_nodes(self):
+        """Абсолютные позиции детей в порядке self.nodes"""
+        for node in self.nodes:
+            yield node.calc_pos(self.calc_next_node_pos(node, self.abs_pos))
+
+    def layout(self, abs_pos, hit_grid: HitGrid, hit_key=(), reachable=True, clip=None):
+        """Раскладывает всё поддерево от абсолютной позиции abs_pos"""
+        self.abs_pos = abs_pos
+        self._hit_key = hit_key
+        self._clip = clip
+        reachable = reachable and self.clickable
+        hit_rect = abs_pos + tuple(self.size)
+        if clip:
+            hit_rect = _clip_rect(hit_rect, clip)
+        if reachable and hit_rect:
+            hit_grid.insert(self, hit_rect, hit_key)
+        else:
+            hit_grid.remove(self)
+
+        if self._removed_nodes:
+            for node in self._removed_nodes:
+                if node.parent is None:
+                    node.unindex(hit_grid)
+            self._removed_nodes = None
+
+        nodes_clip = self.nodes_clip(clip)
+        for index, (node, pos) in enumerate(zip(self.nodes, self.place_nodes())):
+            node.layout(pos, hit_grid, hit_key + (index,), reachable, nodes_clip)
+        self._update_layout_bounds()
+        self._layout_dirty = self._child_layout_dirty = False
+
+    def update_layout(self, hit_grid: HitGrid, reachable=True):
+        """Спускается только в поддеревья с изменившейся раскладкой"""
+        reachable = reachable and self.clickable
+        nodes_clip = self.nodes_clip(self._clip)
+        for index, (node, pos) in enumerate(zip(self.nodes, self.place_nodes())):
+            if node._layout_dirty:
+                node.layout(pos, hit_grid, self._hit_key + (index,), reachable, nodes_clip)
+            elif node._child_layout_dirty:
+                node.update_layout(hit_grid, reachable)
+        self._update_layout_bounds()
+        self._child_layout_dirty = False
+
+    def nodes_clip(self, clip):
+        """Область, в которой видны дети узла"""
+        if not self.clip:
+            return clip
+        rect = self.abs_pos + tuple(self.size)
+        if clip:
+            rect = _clip_rect(rect, clip) or EMPTY_RECT
+        return rect
+
+    def _update_layout_bounds(self):
+        bounds = None
+        if self.size[0] > 0 and self.size[1] > 0:
+            bounds = self.abs_pos + tuple(self.size)
+        if not self.clip:
+            for node in self.nodes:
+                bounds = _union_rect(bounds, node._layout_bounds)
+        self._layout_bounds = bounds
+
+    def unindex(self, hit_grid: HitGrid):
+        hit_grid.remove(self)
         for node in self.nodes:
-            next_pos_off = self.calc_next_node_pos(node, pos_off)
-            node.get_sprites(render, next_pos_off)
+            node.unindex(hit_grid)
+
+    def contains(self, pos):
+        x, y = self.abs_pos
+        return x < pos[0] < x + self.size[0] and y < pos[1] < y + self.size[1]
+
+    def get_sprites(self, render: Render, clip, parent_dirty=False):
+        """Собирает спрайты видимой части поддерева и области окна, которые
+        надо перерисовать. Возвращает область, занятую поддеревом на экране"""
+        dirty = self._dirty and not parent_dirty
+        if dirty and self._drawn_bounds:
+            render.dirty_rects.append(self._drawn_bounds)
+        if not self._layout_bounds or not _clip_rect(self._layout_bounds, clip):
+            # Поддерево за окном или за границей родителя с clip:
+            # create_sprites не вызывается, флаги остаются до появления на экране
+            self._drawn_bounds = None
+            return None
+        if self.cache_subtree:
+            return self._get_layer_sprites(render, clip, dirty, parent_dirty)
+        if self._layer is not None:
+            render.surface_pool.release((self._layer,))
+            self._layer = self._layer_key = None
+        return self._collect_sprites(render, clip, dirty, parent_dirty)
+
+    def _collect_sprites(self, render: Render, clip, dirty, parent_dirty):
+        pos_off = self.abs_pos
+        bounds = None
+        if self.size[0] > 0 and self.size[1] > 0:
+            bounds = _clip_rect(pos_off + tuple(self.size), clip)
+        stale = self._stale_sprites
+        if stale is not None and render.rasterizer is None:
+            # Пул отдаст эти же поверхности create_sprites
+            render.surface_pool.release(stale)
+            self._stale_sprites = stale = None
+        if render.profiler is None:
+            sprites = self.create_sprites(render, pos_off)
+        else:
+            sprites = render.profiler.create_sprites(self, render, pos_off)
+        if stale is not None and sprites is not stale:
+            # Старые спрайты остаются на экране, пока новые растеризуются
+            render.surface_pool.release(stale)
+            self._stale_sprites = None
+        damage = self._damage
+        if damage is not None:
+            self._damage = None
+            damage = _clip_rect((pos_off[0] + damage[0], pos_off[1] + damage[1],
+                                 damage[2], damage[3]), clip)
+            if damage and not dirty and not parent_dirty:
+                render.dirty_rects.append(damage)
+        render.sprites_to_render.extend(sprites)
+        render.sprite_clips.extend(itertools.repeat(clip, len(sprites)))
+        for sprite in sprites:
+            bounds = _union_rect(bounds, _clip_rect(sprite.position + sprite.size, clip))
+
+        nodes_clip = self.nodes_clip(clip)
+        for node in self.nodes:
+            bounds = _union_rect(bounds, node.get_sprites(
+                render, nodes_clip, dirty or parent_dirty))
+
+        self._drawn_bounds = bounds
+        if dirty and bounds:
+            render.dirty_rects.append(bounds)
+        self._dirty = self._child_dirty = False
+        return bounds
+
+    def _get_layer_sprites(self, render: Render, clip, dirty, parent_dirty):
+        """Поддерево рисуется одним спрайтом-слоем. Слой пересобирается,
+        когда что-то изменилось внутри поддерева или поменялась его видимая
+        часть; при перемещении вместе с предком слой только сдвигается"""
+        area = _clip_rect(self._layout_bounds, clip)
+        x, y = self.abs_pos
+        layer_key = (area[0] - x, area[1] - y, area[2], area[3])
+        if self._layer is None or self._dirty or self._child_dirty or \
+                layer_key != self._layer_key:
+            sprites, clips = render.sprites_to_render, render.sprite_clips
+            render.sprites_to_render, render.sprite_clips = list(), list()
+            try:
+                self._collect_sprites(render, clip, dirty, parent_dirty)
+                self._layer = render.flatten(
+                    render.sprites_to_render, render.sprite_clips, area, self._layer)
+            finally:
+                render.sprites_to_render, render.sprite_clips = sprites, clips
+            self._layer_key = layer_key
+        else:
+            self._layer.position = area[:2]
+        self._drawn_bounds = area
+        render.sprites_to_render.append(self._layer)
+        render.sprite_clips.append(clip)
+        return area
 
     @abc.abstractmethod
     def create_sprites(self, render: Render, pos):
+        """Спрайты самого узла, без детей: их get_sprites собирает сам.
+        Составные виджеты, которые рисуются только детьми, возвращают []"""
         pass
 
-    def handle_mouse_event(self, pos_mouse, pos_off, event, *args):
+    def _raster_key(self):
+        # Параметры картинки, которую растеризует Rasterizer: если узел
+        # изменился, пока она готовилась, готовая картинка устарела
+        return None
+
+    def _raster_done(self, render: Render, sprites):
+        # Картинка из потока Rasterizer, показывается со следующего кадра
+        self._sprites = sprites
+        self.mark_dirty()
+
+    def handle_mouse_event(self, pos_mouse, event, *args):
         if not self.clickable:
             return None
 
-        pos_off = self.calc_pos(pos_off)
         for node in reversed(self.nodes):
-            next_pos_off = self.calc_next_node_pos(node, pos_off)
-            node = node.handle_mouse_event(pos_mouse, next_pos_off, event, *args)
+            node = node.handle_mouse_event(pos_mouse, event, *args)
             if node:
                 return node
 
-        if pos_off[0] < pos_mouse[0] and \
-                pos_mouse[0] < pos_off[0] + self.size[0] and \
-                pos_off[1] < pos_mouse[1] and \
-                pos_mouse[1] < pos_off[1] + self.size[1]:
+        if self.contains(pos_mouse):
             if hasattr(self, event):
                 getattr(self, event)(*args)
 
@@ -174,21 +1060,16 @@ class UINode(metaclass=abc.ABCMeta):
         for node in reversed(self.nodes):
             node.get_nodes_with(nodes_acc, event)
 
-    def get_hovered_node(self, pos_mouse, pos_off):
+    def get_hovered_node(self, pos_mouse):
         if not self.clickable:
             return None
 
-        pos_off = self.calc_pos(pos_off)
         for node in reversed(self.nodes):
-            next_pos_off = self.calc_next_node_pos(node, pos_off)
-            hovered_node = node.get_hovered_node(pos_mouse, next_pos_off)
+            hovered_node = node.get_hovered_node(pos_mouse)
             if hovered_node:
                 return hovered_node
 
-        if pos_off[0] < pos_mouse[0] and \
-                pos_mouse[0] < pos_off[0] + self.size[0] and \
-                pos_off[1] < pos_mouse[1] and \
-                pos_mouse[1] < pos_off[1] + self.size[1]:
+        if self.contains(pos_mouse):
             return self
         return None
 
@@ -200,16 +1081,34 @@ class UIPanel(UINode):
         "align": ALIGN
         "sprite"
     }"""
+    __slots__ = ("color", "sprite")
+
     color = tuple()
     sprite = None
+    sprite_props = frozenset(("size", "color", "sprite"))
 
     def create_sprites(self, render: Render, pos_off=(0, 0)):
         if self.sprite:
             return [self.sprite]
-        sprite = render.sprite_factory.create_software_sprite(self.size)
-        sdl2.ext.fill(sprite, self.color)
-        sprite.position = pos_off
-        return [sprite]
+        sprites = self._sprites
+        if sprites is None:
+            sprites = self._stale_sprites
+            if render.renderer:
+                sprites = self._sprites = [FillSprite(self.size, self.color)]
+            elif render.rasterizer is not None and sprites and \
+                    self.size[0] * self.size[1] >= ASYNC_FILL_PIXELS:
+                # Старая заливка остаётся на экране, пока новая готовится
+                params = self._raster_key()
+                render.rasterizer.submit(render, self, params, fill_surface,
+                                         render.surface_pool, *params)
+            else:
+                sprites = self._sprites = fill_surface(
+                    render.surface_pool, self.size, self.color)
+        sprites[0].position = pos_off
+        return sprites
+
+    def _raster_key(self):
+        return (tuple(self.size), self.color)
 
 
 class UIText(UINode):
@@ -220,30 +1119,77 @@ class UIText(UINode):
         "align": ALIGN
         "text_align": ALIGN
         "text_size" : int()
+        "font": str() # alias шрифта в FontManager
     }"""
+    __slots__ = ("text", "color", "text_align", "text_size", "font", "_prerendered")
+
     text = str()
     color = tuple()
     text_align = ALIGN.VCENTER | ALIGN.HCENTER
     text_size = 16
+    font = None
+    sprite_props = frozenset(("size", "color", "text", "text_size", "font"))
+    snapshot_skip = UINode.snapshot_skip | {"_prerendered"}
+    _prerendered = None  # fun() -> SoftwareSprite с готовой надписью из снимка, см. snapshot.load
 
     clickable = False
 
+    def invalidate_sprites(self):
+        self._prerendered = None
+        super().invalidate_sprites()
+
     def create_sprites(self, render: Render, pos_off=(0, 0)):
-        text = render.font_manager.render(self.text, color=self.color, size=self.text_size)
-        sprite = render.sprite_factory.from_surface(text)
+        sprites = self._sprites
+        if sprites is None:
+            sprites = self._stale_sprites
+            if render.rasterizer is not None and sprites and self._prerendered is None:
+                # Старая надпись остаётся на экране, пока новая растеризуется
+                params = self._raster_key()
+                render.rasterizer.submit(render, self, params, rasterize_text,
+                                         render.font_manager, render.surface_pool, *params)
+            else:
+                sprites = self._sprites = [self._render_text(render)]
+        sprite = sprites[0]
+        text_w, text_h = sprite.size
 
         if self.text_align & ALIGN.HCENTER:
             pos_off = (pos_off[0] + self.size[0] //
-                       2 - text.w // 2, pos_off[1])
+                       2 - text_w // 2, pos_off[1])
         if self.text_align & ALIGN.VCENTER:
             pos_off = (pos_off[0], pos_off[1] +
-                       self.size[1] // 2 - text.h // 2)
+                       self.size[1] // 2 - text_h // 2)
         if self.text_align & ALIGN.RIGHT:
-            pos_off = (pos_off[0] + self.size[0] - text.w, pos_off[1])
+            pos_off = (pos_off[0] + self.size[0] - text_w, pos_off[1])
         if self.text_align & ALIGN.BOTTOM:
-            pos_off = (pos_off[0], pos_off[1] + self.size[1] - text.h)
+            pos_off = (pos_off[0], pos_off[1] + self.size[1] - text_h)
         sprite.position = pos_off
-        return [sprite]
+        return sprites
+
+    def _render_text(self, render: Render):
+        if self._prerendered is not None:
+            text, self._prerendered = self._prerendered(), None
+        else:
+            text, = rasterize_text(render.font_manager, render.surface_pool, self.text,
+                                   self.font, self.text_size, self.color)
+        return self._upload(render, text)
+
+    def _raster_key(self):
+        return (self.text, self.font, self.text_size, self.color)
+
+    def _raster_done(self, render: Render, sprites):
+        super()._raster_done(render, [self._upload(render, sprites[0])])
+
+    @staticmethod
+    def _upload(render: Render, text):
+        # В TEXTURE-режиме поверхность надписи переносится в текстуру из пула
+        if not render.renderer:
+            return text
+        pool = render.surface_pool
+        w, h = text.size
+        sprite = pool.texture(w, h, renderer=render.renderer)
+        sdl2.SDL_UpdateTexture(sprite.texture, None, text.surface.pixels, text.surface.pitch)
+        pool.release((text,))
+        return sprite
 
 
 class UIFactory(abstarct_classes.AbstarctUIFactory):
@@ -265,10 +1211,237 @@ class UIFactory(abstarct_classes.AbstarctUIFactory):
         "text" : str()
         "color": (r, g, b, a)
         "align": ALIGN
+        "font": str()
         }"""
         return UIText(pos, size, nodes, **kwargs)
 
 
+class UIApp:
+    """Один цикл UI (поток или asyncio) для нескольких окон SimpleUI.
+
+        app = UIApp()
+        main = SimpleUI("main", (800, 600), configure_main, font_path, app=app)
+        tools = SimpleUI("tools", (300, 600), configure_tools, font_path, app=app)
+        main.run_loop()
+        tools.run_loop()
+
+    Окна рисуются по очереди в одном потоке, события SDL раздаются им
+    по windowID (events.route_events). Очередь команд, таймеры и анимации
+    общие. Шрифты с атласами глифов (по font_path) и SurfacePool тоже
+    общие: строка, уже собранная для одного окна, в другом не растеризуется
+    заново, а поверхности закрытого или перестроенного окна достаются
+    другим. Цикл завершается, когда закрыты все окна.
+    SimpleUI без app создаёт себе собственный UIApp"""
+
+    running = False
+    commands = None
+    scheduler = None
+    surface_pool = None
+    _started = False
+    _ui_thread = None
+    _wakeup_event = None
+    _loop = None  # asyncio-цикл в режиме run_async
+    _wake = None  # asyncio.Event, будит run_async из call_soon/post
+
+    def __init__(self, fps=FPS, pool_bytes=POOL_BYTES, raster_workers=0):
+        """fps — частота кадров анимаций, при vsync берётся частота дисплея
+        pool_bytes — потолок памяти свободных спрайтов общего пула
+        raster_workers — потоков raster.Rasterizer, общего для окон;
+        0 — надписи растеризуются в потоке UI"""
+        self.running = True
+        self.commands = CommandQueue(wakeup=self._wakeup)
+        self.scheduler = Scheduler(fps)
+        self.surface_pool = SurfacePool(max_bytes=pool_bytes)
+        self.font_managers = dict()  # font_path -> GlyphFontManager
+        self.rasterizer = Rasterizer(raster_workers, wakeup=self._wakeup) \
+            if raster_workers else None
+        self.windows = dict()  # windowID -> SimpleUI
+        self.tasks = set()  # Задачи обработчиков-корутин в режиме run_async
+        self._lock = threading.Lock()
+        self._pending = list()  # SimpleUI, открытые до запуска цикла
+
+    def open(self, ui):
+        """Открывает окно ui: при запуске цикла или, если он уже идёт,
+        перед следующим кадром"""
+        with self._lock:
+            if not self.running:
+                raise RuntimeError("UI app is stopped")
+            if not self._started:
+                self._pending.append(ui)
+                return
+            # Под блокировкой: _stop() не пропустит команду при последнем drain
+            self.call_soon(self._open_window, ui)
+
+    def _open_window(self, ui):
+        if not self.running:
+            # Цикл завершается, окно не создаётся
+            ui._set_ready()
+            return
+        ui._start()
+        self.windows[ui.window_id] = ui
+
+    def _close_window(self, window_id):
+        self.windows.pop(window_id)._close()
+
+    def font_manager(self, font_path):
+        """GlyphFontManager шрифта font_path, общий для всех окон"""
+        manager = self.font_managers.get(font_path)
+        if manager is None:
+            manager = self.font_managers[font_path] = GlyphFontManager(font_path)
+        return manager
+
+    def _claim(self):
+        # Окна, которые откроет запускаемый цикл; None, если цикл уже запущен
+        with self._lock:
+            if self._started:
+                return None
+            self._started = True
+            pending, self._pending = self._pending, list()
+        return pending
+
+    def run_loop(self):
+        """Запускает цикл UI в отдельном потоке, если он ещё не запущен"""
+        pending = self._claim()
+        if pending is not None:
+            threading.Thread(target=self._ui_loop, args=(pending,), name="ui_loop").start()
+
+    async def run_async(self):
+        """Цикл UI как корутина в текущем asyncio-цикле, см. SimpleUI.run_async.
+        Завершается, когда закрыты все окна"""
+        pending = self._claim()
+        if pending is None:
+            raise RuntimeError("UI app is already running")
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        try:
+            self._start(pending)
+            while self.running and self.windows:
+                self._frame()
+                if self._is_dirty():
+                    await asyncio.sleep(0)
+                else:
+                    await self._wait_async(min(self.scheduler.timeout(IDLE_TIMEOUT),
+                                               self.scheduler.step * 1000))
+                self._dispatch_events()
+        finally:
+            self._stop()
+            for task in list(self.tasks):
+                task.cancel()
+            self._loop = self._wake = None
+
+    async def _wait_async(self, timeout):
+        # Новые события SDL не будят asyncio: ждём не дольше timeout мс
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout / 1000)
+        except asyncio.TimeoutError:
+            pass
+        self._wake.clear()
+
+    def _run_coroutine(self, coroutine):
+        task = self._loop.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self._task_done)
+
+    def _task_done(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            task.get_loop().call_exception_handler({
+                "message": "Exception in UI event handler",
+                "exception": task.exception(),
+                "task": task,
+            })
+
+    def _ui_loop(self, pending):
+        try:
+            self._start(pending)
+            while self.running and self.windows:
+                self._frame()
+                # Спим до следующего шага анимации или таймера, события будят раньше
+                if not self._is_dirty():
+                    sdl2.SDL_WaitEventTimeout(None, self.scheduler.timeout(IDLE_TIMEOUT))
+                self._dispatch_events()
+        finally:
+            self._stop()
+
+    def _start(self, pending):
+        try:
+            sdl2.ext.init()
+            sdl2.sdlttf.TTF_Init()
+            self._ui_thread = threading.current_thread()
+            self._wakeup_event = sdl2.SDL_RegisterEvents(1)
+            for ui in pending:
+                self._open_window(ui)
+        finally:
+            for ui in pending:
+                ui._set_ready()
+
+    def _stop(self):
+        with self._lock:
+            self.running = False
+        # Дожидающиеся в call_soon().result() потоки не должны зависнуть
+        self.commands.drain()
+        for window_id in list(self.windows):
+            self._close_window(window_id)
+        if self.rasterizer is not None:
+            self.rasterizer.shutdown()
+
+    def _is_dirty(self):
+        return any(ui.render.is_dirty() for ui in self.windows.values())
+
+    def _profiler(self):
+        # Общие фазы commands и animate считает первый включённый профайлер
+        for ui in self.windows.values():
+            if ui.render.profiler is not None:
+                return ui.render.profiler
+        return None
+
+    def _frame(self):
+        profiler = self._profiler()
+        if profiler is None:
+            self.commands.drain()
+            self.scheduler.tick()
+        else:
+            profiler.timed("commands", self.commands.drain)
+            profiler.timed("animate", self.scheduler.tick)
+        for ui in list(self.windows.values()):
+            ui.render.draw()
+
+    def _dispatch_events(self):
+        events = sdl2.ext.get_events()
+        windows = self.windows
+        if len(windows) == 1:
+            # Единственному окну события достаются без разбора по windowID
+            for ui in windows.values():
+                ui._dispatch(events)
+        elif events:
+            routed = route_events(events, windows)
+            for window_id, ui in list(windows.items()):
+                if routed[window_id]:
+                    ui._dispatch(routed[window_id])
+        for window_id, ui in list(windows.items()):
+            if not ui.running:
+                self._close_window(window_id)
+
+    def _wakeup(self):
+        loop, wake = self._loop, self._wake
+        if loop is not None and wake is not None:
+            # run_async спит в asyncio, а не в SDL_WaitEventTimeout
+            loop.call_soon_threadsafe(wake.set)
+            return
+        # SDL_PushEvent потокобезопасен, будим SDL_WaitEventTimeout
+        if self._wakeup_event is None or self._wakeup_event == 0xFFFFFFFF:
+            return
+        event = sdl2.SDL_Event()
+        event.type = self._wakeup_event
+        sdl2.SDL_PushEvent(ctypes.byref(event))
+
+    def in_ui_thread(self):
+        return self._ui_thread is None or threading.current_thread() is self._ui_thread
+
+    def call_soon(self, fn, *args, **kwargs):
+        return self.commands.call_soon(fn, *args, **kwargs)
+
+
 class SimpleUI:
 
     win_name = str()
@@ -277,55 +1450,261 @@ class SimpleUI:
     font_path = str()
     running = False
     render = None
-
-    def __init__(self, win_name, win_size, ui_three_configure, font_path):
+    sprite_type = sdl2.ext.SOFTWARE
+    vsync = False
+    app = None
+    commands = None
+    scheduler = None
+    events = None
+    reconciler = None
+    window_id = None  # SDL windowID, по нему UIApp раздаёт события
+
+    def __init__(self, win_name, win_size, ui_three_configure, font_path,
+                 sprite_type=sdl2.ext.SOFTWARE, fps=FPS, vsync=False,
+                 snapshot=None, snapshot_key=None, snapshot_handlers=None, app=None,
+                 raster_workers=0):
+        """sprite_type = sdl2.ext.SOFTWARE | sdl2.ext.TEXTURE
+        fps — частота кадров анимаций, при vsync берётся частота дисплея
+        snapshot — файл снимка дерева (см. snapshot.py): если он есть и записан
+        с тем же snapshot_key и шрифтом, дерево загружается из него без
+        ui_three_configure, иначе строится и сохраняется в него.
+        snapshot_handlers = {s_id: {"click_event": fun, ...}} — обработчики,
+        которые не сохраняются в файл (lambda, замыкания). Снимок, для которого
+        нашлись не все обработчики, не используется и не записывается
+        app — UIApp, общий с другими окнами (fps и raster_workers тогда
+        задаёт он); без него окно создаёт себе свой UIApp
+        raster_workers — потоков растеризации изменившихся надписей,
+        см. raster.Rasterizer"""
         self.win_name = win_name
         self.win_size = win_size
         self.ui_three_configure = ui_three_configure
         self.font_path = font_path
+        self.sprite_type = sprite_type
+        self.vsync = vsync
+        self.snapshot = snapshot
+        self.snapshot_key = snapshot_key
+        self.snapshot_handlers = snapshot_handlers
         self.running = True
+        self.app = app if app is not None else UIApp(fps, raster_workers=raster_workers)
+        self.commands = self.app.commands
+        self.scheduler = self.app.scheduler
+        self.tasks = self.app.tasks
+        self._ready = threading.Event()
+        self._ready_lock = threading.Lock()
+        self._ready_waiters = list()  # (asyncio-цикл, future) из wait_ready
 
     def run_loop(self):
-        t = threading.Thread(target=self._ui_loop, name="ui_loop")
-        t.start()
-        while not self.render:
-            time.sleep(0.01)
-
-    def _ui_loop(self):
-        sdl2.ext.init()
-        sdl2.sdlttf.TTF_Init()
-
+        """Открывает окно в цикле UI приложения, запуская его в отдельном
+        потоке, если он ещё не идёт, и ждёт, пока окно и Render будут созданы"""
+        self.app.open(self)
+        self.app.run_loop()
+        self._ready.wait()
+        if self.render is None:
+            raise RuntimeError("UI loop failed to start")
+
+    async def run_async(self):
+        """Цикл UI как корутина в текущем asyncio-цикле, без отдельного потока:
+
+            task = asyncio.create_task(ui.run_async())
+            await ui.wait_ready()
+
+        Обработчики событий могут быть корутинами (async def click_event),
+        они запускаются задачами того же цикла, и корутины могут менять узлы
+        напрямую. Когда перерисовывать нечего, цикл ждёт событий SDL
+        не дольше шага анимаций, отдавая управление другим задачам;
+        post/call_soon из других потоков будят его сразу. Завершается
+        вместе с окнами, незаконченные задачи обработчиков отменяются.
+        Если цикл общего app уже идёт, только открывает в нём окно
+        и дожидается его создания"""
+        self.app.open(self)
+        if self.app._started:
+            await self.wait_ready()
+        else:
+            await self.app.run_async()
+
+    async def wait_ready(self):
+        """Дожидается создания окна и Render. Работает из любого
+        asyncio-цикла и в обоих режимах: run_loop и run_async"""
+        with self._ready_lock:
+            if self._ready.is_set():
+                return
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._ready_waiters.append((loop, future))
+        await future
+
+    def _set_ready(self):
+        """Будит wait_ready и run_loop; вызывается в finally, чтобы они
+        не ждали вечно, если окно не открылось"""
+        with self._ready_lock:
+            self._ready.set()
+            waiters, self._ready_waiters = self._ready_waiters, list()
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(self._resolve, future)
+
+    @staticmethod
+    def _resolve(future):
+        if not future.done():
+            future.set_result(None)
+
+    def _start(self):
+        try:
+            self._create_window()
+        finally:
+            self._set_ready()
+
+    def _create_window(self):
         self.sdl_window = sdl2.ext.Window(self.win_name, self.win_size)
         self.sdl_window.show()
+        self.window_id = sdl2.SDL_GetWindowID(self.sdl_window.window)
+        # Шрифты и пул общие для всех окон app
+        shared = {"font_manager": self.app.font_manager(self.font_path),
+                  "surface_pool": self.app.surface_pool,
+                  "rasterizer": self.app.rasterizer}
+
+        loaded = self._load_snapshot() if self.snapshot else None
+        if loaded is None:
+            self.start_ui_node = self.ui_three_configure(UIFactory(self.sdl_window))
+            self.render = Render(self.sdl_window, self.start_ui_node,
+                                 self.font_path, self.sprite_type, self.vsync, **shared)
+            if self.snapshot:
+                self._save_snapshot()
+        else:
+            self.start_ui_node = loaded.root
+            self.render = Render(self.sdl_window, self.start_ui_node,
+                                 self.font_path, self.sprite_type, self.vsync,
+                                 hit_grid=loaded.hit_grid, **shared)
+        self.events = EventDispatcher(self.render, (self.app._wakeup_event,))
+        if self.app._loop is not None:
+            self.render.run_coroutine = self.app._run_coroutine
+        if self.render.vsync and self.render.refresh_rate():
+            # Кадры и так идут с частотой дисплея, шаг анимаций подстраиваем под неё
+            self.scheduler.fps = self.render.refresh_rate()
+
+    def _load_snapshot(self):
+        from . import snapshot
+
+        try:
+            loaded = snapshot.load(self.snapshot, UIFactory(self.sdl_window),
+                                   self.snapshot_handlers, self.snapshot_key, self.font_path)
+        except Exception as exc:
+            # Снимок — только кэш: испорченный или устаревший файл
+            # не мешает построить дерево заново
+            warnings.warn("can't load UI snapshot %r: %r" % (self.snapshot, exc))
+            return None
+        if loaded is not None and loaded.unbound:
+            warnings.warn("UI snapshot %r has no handlers for %r, building the tree again"
+                          % (self.snapshot, loaded.unbound))
+            return None
+        return loaded
+
+    def _save_snapshot(self):
+        from . import snapshot
+
+        try:
+            snapshot.save(self.render, self.snapshot, self.snapshot_key,
+                          self.snapshot_handlers or {})
+        except (OSError, TypeError, ValueError, AttributeError, pickle.PicklingError) as exc:
+            # В дереве есть то, что не сохраняется (блокировка, сокет,
+            # TextureSprite) или не восстановится без snapshot_handlers:
+            # окно работает без снимка
+            warnings.warn("can't save UI snapshot %r: %r" % (self.snapshot, exc))
+
+    def _dispatch(self, events):
+        profiler = self.render.profiler
+        if profiler is None:
+            running = self.events.dispatch(events)
+        else:
+            # События попадут в статистику следующего нарисованного кадра
+            running = profiler.timed("events", self.events.dispatch, events)
+        if not running:
+            self.running = False
+
+    def _close(self):
+        self.running = False
+        if self.render.profiler is not None:
+            self.render.profiler.detach()
+        self.render.close()
+        self.sdl_window.close()
+
+    def close(self):
+        """Закрывает окно; цикл UI завершается, когда закрыты все окна app"""
+        self.running = False
+        self.app._wakeup()
+
+    def in_ui_thread(self):
+        return self.app.in_ui_thread()
+
+    def post(self, fn, *args, coalesce=False, **kwargs):
+        """Выполнить fn(*args, **kwargs) в потоке UI перед следующим кадром.
+        Возвращает Future. С coalesce=True повторный post того же метода
+        того же узла до кадра заменяет предыдущий (побеждает последний
+        set_text); другое значение coalesce — свой ключ схлопывания.
+        Без coalesce выполняется каждый вызов по порядку (add_elem)"""
+        return self.commands.post(fn, *args, coalesce=coalesce, **kwargs)
+
+    def call_soon(self, fn, *args, **kwargs):
+        """Как post без coalesce: выполнится каждый вызов по порядку"""
+        return self.commands.call_soon(fn, *args, **kwargs)
+
+    def _call_in_ui(self, fn, *args, **kwargs):
+        if self.in_ui_thread() or not self.app.running:
+            return fn(*args, **kwargs)
+        return self.call_soon(fn, *args, **kwargs).result()
+
+    def enable_profiler(self, overlay=False):
+        """Включает FrameProfiler (см. profiler.py) и возвращает его.
+        overlay — показывать статистику поверх окна"""
+        return self._call_in_ui(self._enable_profiler, overlay)
+
+    def _enable_profiler(self, overlay):
+        profiler = self.render.profiler
+        if profiler is None:
+            profiler = FrameProfiler()
+            profiler.attach(self.render)
+        if overlay:
+            profiler.show_overlay()
+        return profiler
+
+    def disable_profiler(self):
+        profiler = self.render.profiler
+        if profiler is not None:
+            self._call_in_ui(profiler.detach)
+        return profiler
+
+    def reconcile(self, parent, descriptions):
+        """Приводит детей узла parent (или узла с таким s_id) к описаниям,
+        см. reconcile.Reconciler. Возвращает счётчики изменений"""
+        return self._call_in_ui(self._reconcile, parent, descriptions)
+
+    def _reconcile(self, parent, descriptions):
+        from .reconcile import Reconciler
+
+        if self.reconciler is None:
+            self.reconciler = Reconciler(UIFactory(self.sdl_window))
+        if isinstance(parent, str):
+            parent = self.render.get_node_by_name(parent)
+        return self.reconciler.reconcile(parent, descriptions)
+
+    def animate(self, node, prop, end, duration, **kwargs):
+        """Анимирует node.prop (pos, size, color, ...) к end за duration секунд.
+        kwargs = {
+            "easing": fun(k) -> k # animation.linear, ease_in_out, ease_out_cubic
+            "on_done": fun()
+            "start": начальное значение вместо текущего
+        }"""
+        return self._call_in_ui(self.scheduler.animate, node, prop, end, duration, **kwargs)
+
+    def call_later(self, delay, fn, *args):
+        """Вызвать fn(*args) в потоке UI через delay секунд. Возвращает Timer"""
+        return self._call_in_ui(self.scheduler.call_later, delay, fn, *args)
 
-        self.start_ui_node = self.ui_three_configure(UIFactory(self.sdl_window))
-
-        self.render = Render(self.sdl_window, self.start_ui_node, self.font_path)
-
-        while self.running:
-            self.render.draw()
-            events = sdl2.ext.get_events()
-            for event in events:
-                if event.type == sdl2.SDL_QUIT:
-                    self.running = False
-                    break
-                if event.type == sdl2.SDL_MOUSEBUTTONDOWN:
-                    self.render.mouse_down((event.button.x, event.button.y))
-                    break
-                if event.type == sdl2.SDL_MOUSEBUTTONUP:
-                    self.render.mouse_up((event.button.x, event.button.y))
-                    break
-                if event.type == sdl2.SDL_MOUSEMOTION:
-                    x, y = event.button.x, event.button.y
-                    self.render.mouse_hover((x, y))
-                    if (time.time() - self.render.click_timer > TIME_TO_CLICK and self.render.selected_node):
-                        self.render.mouse_drag((x, y))
-                    break
-            self.sdl_window.refresh()
+    def call_every(self, interval, fn, *args):
+        return self._call_in_ui(self.scheduler.call_every, interval, fn, *args)
 
     def get_node_by_name(self, name):
-        return self.render.get_node_by_name(name)
+        return self._call_in_ui(self.render.get_node_by_name, name)
 
     def remove_node_by_name(self, name):
-        # TODO Сделай возвращаемые коды статуса выполнения
-        self.render.remove_node_by_name(name)
\ No newline at end of file
+        """True, если узел найден и убран из родителя"""
+        return self._call_in_ui(self.render.remove_node_by_name, name)
\ No newline at end of file
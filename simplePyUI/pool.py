@@ -0,0 +1,154 @@
+import collections
+import threading
+
+import sdl2
+import sdl2.ext
+
+POOL_BYTES = 16 * 1024 * 1024  # Потолок памяти свободных поверхностей и текстур пула
+SURFACE = "surface"
+TEXTURE = "texture"
+
+
+class SurfacePool:
+    """Свободные поверхности и текстуры, разложенные по корзинам
+    (вид, формат, ширина, высота, renderer текстуры).
+
+    Узел, у которого поменялась картинка, возвращает старые спрайты
+    в пул (UINode.invalidate_sprites, затем Render при сборе кадра),
+    а новый спрайт того же размера достаётся из пула вместо создания.
+    Поэтому в установившемся режиме, когда размеры спрайтов повторяются,
+    кадр не создаёт и не освобождает ни поверхностей SDL, ни обёрток
+    sdl2.ext. Свободные спрайты занимают не больше max_bytes: сверх
+    этого возвращённый спрайт просто отпускается и освобождается сборщиком
+    мусора, а первыми выбрасываются давно не использованные корзины.
+
+    Спрайты пула помечены атрибутом pool_key, чужие спрайты release()
+    пропускает. Пиксели выданного спрайта не очищаются.
+
+    Пул может быть общим для нескольких окон (UIApp): поверхности подходят
+    любому окну, а текстуры выдаются только тому renderer, которым созданы,
+    и выбрасываются forget() перед его уничтожением. Корзины защищены
+    блокировкой: поверхности берут и потоки Rasterizer."""
+
+    def __init__(self, renderer=None, max_bytes=POOL_BYTES):
+        self.renderer = renderer  # sdl2.ext.Renderer для текстур по умолчанию
+        self.max_bytes = max_bytes
+        self.buckets = collections.OrderedDict()  # key -> [спрайт, ...]
+        self._lock = threading.Lock()
+        self.idle_bytes = 0
+        self.peak_bytes = 0  # Наибольший объём свободных спрайтов
+
+        self.hits = 0
+        self.misses = 0
+        self.released = 0
+        self.discarded = 0
+
+    # Выдача
+
+    def surface(self, w, h, pixel_format=sdl2.SDL_PIXELFORMAT_ARGB8888):
+        """SoftwareSprite размером w x h. Поверхности с альфа-каналом
+        смешиваются при выводе (SDL_BLENDMODE_BLEND), без него — копируются"""
+        return self._acquire((SURFACE, pixel_format, w, h, None))
+
+    def texture(self, w, h, access=sdl2.SDL_TEXTUREACCESS_STATIC, renderer=None):
+        """TextureSprite ARGB8888 размером w x h со смешиванием по альфе
+        для renderer (по умолчанию self.renderer)"""
+        return self._acquire((TEXTURE, access, w, h, renderer or self.renderer))
+
+    def _acquire(self, key):
+        with self._lock:
+            sprites = self.buckets.get(key)
+            if sprites:
+                self.hits += 1
+                self.buckets.move_to_end(key)
+                sprite = sprites.pop()
+                sprite.pool_idle = False
+                self.idle_bytes -= self._bytes(key)
+                return sprite
+            self.misses += 1
+        kind, fmt, w, h, renderer = key
+        if kind == SURFACE:
+            sprite = self.new_surface(w, h, fmt)
+        else:
+            sprite = self.new_texture(w, h, fmt, renderer)
+        sprite.pool_key = key
+        sprite.pool_idle = False
+        return sprite
+
+    # Создание, единственные места выделения памяти под спрайты
+
+    def new_surface(self, w, h, pixel_format):
+        surface = sdl2.SDL_CreateRGBSurfaceWithFormat(0, w, h, 32, pixel_format)
+        if not surface:
+            raise sdl2.ext.SDLError()
+        return sdl2.ext.SoftwareSprite(surface.contents, True)
+
+    def new_texture(self, w, h, access, renderer=None):
+        renderer = renderer or self.renderer
+        texture = sdl2.SDL_CreateTexture(
+            renderer.sdlrenderer, sdl2.SDL_PIXELFORMAT_ARGB8888, access, w, h)
+        if not texture:
+            raise sdl2.ext.SDLError()
+        sdl2.SDL_SetTextureBlendMode(texture, sdl2.SDL_BLENDMODE_BLEND)
+        return sdl2.ext.TextureSprite(texture.contents)
+
+    # Возврат
+
+    def release(self, sprites):
+        """Возвращает спрайты пула в их корзины. Спрайты не из пула
+        и уже возвращённые пропускаются"""
+        with self._lock:
+            for sprite in sprites:
+                key = getattr(sprite, "pool_key", None)
+                if key is None or sprite.pool_idle:
+                    continue
+                self.released += 1
+                size = self._bytes(key)
+                if size > self.max_bytes:
+                    self.discarded += 1
+                    continue
+                self._trim(self.max_bytes - size)
+                sprite.pool_idle = True
+                self.buckets.setdefault(key, list()).append(sprite)
+                self.buckets.move_to_end(key)
+                self.idle_bytes += size
+                self.peak_bytes = max(self.peak_bytes, self.idle_bytes)
+
+    def _trim(self, max_bytes):
+        # Выбрасываем спрайты из давно не использованных корзин
+        while self.idle_bytes > max_bytes:
+            key, sprites = next(iter(self.buckets.items()))
+            if not sprites:
+                del self.buckets[key]
+                continue
+            sprites.pop(0)
+            self.idle_bytes -= self._bytes(key)
+            self.discarded += 1
+
+    @staticmethod
+    def _bytes(key):
+        return key[2] * key[3] * 4
+
+    def forget(self, renderer):
+        """Отпускает свободные текстуры renderer: вызывается до его уничтожения"""
+        with self._lock:
+            for key in [key for key in self.buckets if key[4] is renderer]:
+                self.idle_bytes -= self._bytes(key) * len(self.buckets.pop(key))
+
+    def clear(self):
+        """Отпускает все свободные спрайты"""
+        with self._lock:
+            self.buckets.clear()
+            self.idle_bytes = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "released": self.released,
+            "discarded": self.discarded,
+            "idle": sum(len(sprites) for sprites in self.buckets.values()),
+            "idle_bytes": self.idle_bytes,
+            "peak_bytes": self.peak_bytes,
+            "max_bytes": self.max_bytes,
+        }
@@ -0,0 +1,237 @@
+import bisect
+import collections
+import time
+
+PHASES = ("events", "commands", "animate", "layout", "collect", "rasterize", "blit")
+HISTORY_FRAMES = 240  # Кадров в скользящем окне статистики
+HISTOGRAM_BOUNDS = (1, 2, 4, 8, 16, 33, 66)  # Верхние границы корзин, мс
+OVERLAY_PERIOD = 0.5  # с между обновлениями оверлея
+# Методы SpriteFactory, создающие поверхность или текстуру
+ALLOCATING_METHODS = ("from_surface", "from_image", "from_color", "from_text",
+                      "create_sprite", "create_software_sprite",
+                      "create_texture_sprite")
+POOL_ALLOCATING_METHODS = ("new_surface", "new_texture")  # Промахи SurfacePool
+
+
+class NodeCost:
+    __slots__ = ("calls", "seconds")
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+
+
+class FrameProfiler:
+    """Время фаз кадра, стоимость create_sprites по типам узлов и s_id
+    и число созданных поверхностей.
+
+    Подключается к Render через attach(): пока Render.profiler равен None,
+    отрисовка и цикл событий проверяют только этот атрибут.
+
+    Фазы кадра: events, commands и animate — обработка событий, очереди
+    команд, таймеров и анимаций перед кадром, layout — раскладка,
+    collect — обход дерева без учёта create_sprites, rasterize —
+    create_sprites (шрифты, поверхности, текстуры), blit — вывод на экран."""
+
+    def __init__(self, history=HISTORY_FRAMES):
+        self.render = None
+        self.frames = collections.deque(maxlen=history)  # {фаза: с, "total", "allocations"}
+        self.by_type = collections.defaultdict(NodeCost)
+        self.by_s_id = collections.defaultdict(NodeCost)
+        self.frame_count = 0
+        self.allocations = 0
+        self.overlay = None
+
+        self._current = dict.fromkeys(PHASES, 0.0)
+        self._frame_allocations = 0
+        self._last_mark = 0.0
+        self._nested = 0.0  # rasterize с последней отметки, вычитается из неё
+        self._wrapped = dict()
+
+    def attach(self, render):
+        if self.render is not None:
+            self.detach()
+        self.render = render
+        render.profiler = self
+        self._wrap(render.sprite_factory, ALLOCATING_METHODS)
+        self._wrap(render.font_manager, ("render",))
+        self._wrap(render.surface_pool, POOL_ALLOCATING_METHODS)
+
+    def detach(self):
+        if self.overlay is not None:
+            self.overlay.remove()
+            self.overlay = None
+        for (obj, name) in self._wrapped:
+            # Убираем обёртку экземпляра, снова виден метод класса
+            delattr(obj, name)
+        self._wrapped = dict()
+        if self.render is not None:
+            self.render.profiler = None
+            self.render = None
+
+    def _wrap(self, obj, names):
+        for name in names:
+            method = getattr(obj, name, None)
+            if method is None:
+                continue
+            if name in vars(obj):
+                # Кэш, общий с другим окном (UIApp), уже считает его профайлер
+                continue
+
+            def counted(*args, _method=method, **kwargs):
+                self._frame_allocations += 1
+                return _method(*args, **kwargs)
+
+            setattr(obj, name, counted)
+            self._wrapped[(obj, name)] = method
+
+    # Отметки времени внутри кадра
+
+    def timed(self, phase, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self._current[phase] += time.perf_counter() - start
+
+    def start_frame(self):
+        self._last_mark = time.perf_counter()
+        self._nested = 0.0
+
+    def mark(self, phase):
+        """Время с прошлой отметки уходит в phase"""
+        now = time.perf_counter()
+        self._current[phase] += now - self._last_mark - self._nested
+        self._last_mark = now
+        self._nested = 0.0
+
+    def create_sprites(self, node, render, pos_off):
+        start = time.perf_counter()
+        sprites = node.create_sprites(render, pos_off)
+        spent = time.perf_counter() - start
+        self._current["rasterize"] += spent
+        self._nested += spent
+
+        cost = self.by_type[type(node).__name__]
+        cost.calls += 1
+        cost.seconds += spent
+        if node.s_id:
+            cost = self.by_s_id[node.s_id]
+            cost.calls += 1
+            cost.seconds += spent
+        return sprites
+
+    def end_frame(self):
+        frame = self._current
+        frame["total"] = sum(frame[phase] for phase in PHASES)
+        frame["allocations"] = self._frame_allocations
+        self.frames.append(frame)
+        self.frame_count += 1
+        self.allocations += self._frame_allocations
+
+        self._current = dict.fromkeys(PHASES, 0.0)
+        self._frame_allocations = 0
+        if self.overlay is not None:
+            self.overlay.update()
+
+    # Статистика
+
+    def histogram(self, bounds=HISTOGRAM_BOUNDS):
+        """Число кадров окна по корзинам времени кадра.
+        [(верхняя граница в мс | None для последней, кадров), ...]"""
+        counts = [0] * (len(bounds) + 1)
+        for frame in self.frames:
+            counts[bisect.bisect_left(bounds, frame["total"] * 1000)] += 1
+        return list(zip(tuple(bounds) + (None,), counts))
+
+    def stats(self):
+        """Сводка по скользящему окну кадров; время в миллисекундах"""
+        frames = list(self.frames)
+        phases = dict()
+        for phase in PHASES + ("total",):
+            values = sorted(frame[phase] * 1000 for frame in frames)
+            phases[phase] = {
+                "mean": sum(values) / len(values) if values else 0.0,
+                "p95": values[int(len(values) * 0.95)] if values else 0.0,
+                "max": values[-1] if values else 0.0,
+            }
+        return {
+            "frames": self.frame_count,
+            "window": len(frames),
+            "phases": phases,
+            "allocations": self.allocations,
+            "allocations_per_frame": (
+                sum(frame["allocations"] for frame in frames) / len(frames)
+                if frames else 0.0),
+            "histogram": self.histogram(),
+            "by_type": self._costs(self.by_type),
+            "by_s_id": self._costs(self.by_s_id),
+            "pool": self.render.surface_pool.stats() if self.render else None,
+        }
+
+    @staticmethod
+    def _costs(costs):
+        return {key: {"calls": cost.calls, "ms": cost.seconds * 1000}
+                for key, cost in costs.items()}
+
+    def reset(self):
+        self.frames.clear()
+        self.by_type.clear()
+        self.by_s_id.clear()
+        self.frame_count = 0
+        self.allocations = 0
+
+    def show_overlay(self, pos=(0, 0), **kwargs):
+        if self.overlay is None:
+            self.overlay = ProfilerOverlay(self, pos, **kwargs)
+        return self.overlay
+
+
+class ProfilerOverlay:
+    """Панель со статистикой поверх дерева из обычных UIPanel и UIText.
+    Текст меняется не чаще раза в OVERLAY_PERIOD, чтобы оверлей сам
+    не заставлял перерисовывать окно каждый кадр"""
+
+    line_h = 16
+    width = 260
+
+    def __init__(self, profiler, pos=(0, 0), color=(0, 0, 0, 200),
+                 color_text=(0, 255, 0, 255), text_size=12, lines=8):
+        from .main import ALIGN, UIPanel, UIText
+
+        self.profiler = profiler
+        self.last_update = 0.0
+        self.texts = [
+            UIText((4, 2 + i * self.line_h), (self.width - 8, self.line_h),
+                   color=color_text, text_size=text_size,
+                   text_align=ALIGN.LEFT | ALIGN.VCENTER)
+            for i in range(lines)]
+        self.panel = UIPanel(pos, (self.width, lines * self.line_h + 4), self.texts,
+                             color=color, clickable=False, s_id="profiler_overlay")
+        profiler.render.start_ui_node.nodes.append(self.panel)
+
+    def lines(self):
+        stats = self.profiler.stats()
+        phases = stats["phases"]
+        total = phases["total"]
+        lines = ["frame %.2f ms  p95 %.2f  max %.2f" % (
+            total["mean"], total["p95"], total["max"])]
+        lines.extend("%-9s %.2f ms" % (phase, phases[phase]["mean"])
+                     for phase in ("events", "layout", "collect", "rasterize", "blit"))
+        lines.append("alloc/frame %.1f" % stats["allocations_per_frame"])
+        slowest = sorted(stats["by_type"].items(), key=lambda item: -item[1]["ms"])
+        lines.append(" ".join("%s %.1f" % (name, cost["ms"]) for name, cost in slowest[:2]))
+        return lines
+
+    def update(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_update < OVERLAY_PERIOD:
+            return
+        self.last_update = now
+        lines = self.lines()
+        for i, text in enumerate(self.texts):
+            text.text = lines[i] if i < len(lines) else str()
+
+    def remove(self):
+        if self.panel.parent is not None:
+            self.panel.parent.nodes.remove(self.panel)
@@ -0,0 +1,154 @@
+import concurrent.futures
+import threading
+
+import sdl2
+import sdl2.ext
+
+RASTER_WORKERS = 1  # Надписи всё равно идут по очереди под блокировкой шрифтов
+ASYNC_FILL_PIXELS = 256 * 256  # Меньшие заливки панелей дешевле сделать на месте
+
+
+class Rasterizer:
+    """Потоки, растеризующие новые картинки узлов, пока на экране
+    остаются старые.
+
+    create_sprites узла, у которого есть прежняя картинка, отдаёт работу
+    в submit() и возвращает прежние спрайты. Работа кадра копится
+    и уходит в потоки одной пачкой на поток (flush() после сбора кадра,
+    пока поток UI выводит его на экран). Готовые спрайты забирает swap()
+    в потоке UI в начале Render.draw: узел получает их через _raster_done
+    и перерисовывается, а старые спрайты возвращаются в пул. Если узел
+    успел измениться ещё раз (node._raster_key() уже другой), устаревшая
+    картинка выбрасывается.
+
+    Работа в потоках пула трогает только общие GlyphFontManager и
+    SurfacePool (оба под своими блокировками) и собственные поверхности,
+    текстуры по-прежнему создаются и заполняются в потоке UI. Надписи
+    растеризуются по очереди под блокировкой FontManager, зато поток UI
+    в это время разбирает события и рисует кадры.
+
+    Все методы, кроме wakeup, выполняются в потоке UI. Один Rasterizer
+    может обслуживать несколько Render (UIApp)."""
+
+    def __init__(self, workers=RASTER_WORKERS, wakeup=None):
+        self.workers = workers
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            workers, thread_name_prefix="raster")
+        self.wakeup = wakeup  # Будит цикл UI, когда готова пачка картинок
+        self.jobs = dict()  # node -> (render, key) картинки, которая готовится
+        self._batch = list()  # [(render, node, key, fn, args), ...] текущего кадра
+        self._lock = threading.Lock()
+        self._done = dict()  # render -> [(node, key, sprites, ошибка), ...]
+
+        self.submitted = 0
+        self.swapped = 0
+        self.dropped = 0  # Картинки, устаревшие до swap()
+
+    def submit(self, render, node, key, fn, *args):
+        """Выполнит fn(*args) -> [спрайт, ...] в потоке пула для node.
+        key — параметры картинки (node._raster_key()): повторный submit
+        того же key, пока картинка готовится, ничего не делает"""
+        job = (render, key)
+        if self.jobs.get(node) == job:
+            return
+        self.jobs[node] = job
+        self._batch.append((render, node, key, fn, args))
+        self.submitted += 1
+
+    def flush(self):
+        """Отдаёт накопленную работу потокам, по пачке на поток"""
+        batch, self._batch = self._batch, list()
+        if not batch:
+            return
+        with self._lock:
+            for render, *_job in batch:
+                self._done.setdefault(render, list())
+        step = -(-len(batch) // self.workers)
+        for i in range(0, len(batch), step):
+            self.executor.submit(self._run, batch[i:i + step])
+
+    def _run(self, batch):
+        # Поток пула
+        results = list()
+        for render, node, key, fn, args in batch:
+            try:
+                results.append((render, node, key, fn(*args), None))
+            except Exception as exc:
+                results.append((render, node, key, None, exc))
+        with self._lock:
+            for render, *result in results:
+                done = self._done.get(render)
+                # Закрытый Render (forget) картинки уже не ждёт
+                if done is not None:
+                    done.append(result)
+        if self.wakeup is not None:
+            self.wakeup()
+
+    def swap(self, render):
+        """Отдаёт узлам render готовые картинки. Возвращает их число"""
+        with self._lock:
+            done = self._done.get(render)
+            if not done:
+                return 0
+            self._done[render] = list()
+        swapped = 0
+        error = None
+        for node, key, sprites, exc in done:
+            job = self.jobs.get(node)
+            if job != (render, key) or node._raster_key() != key:
+                if job == (render, key):
+                    # Узел изменился: create_sprites отдаст новую работу
+                    del self.jobs[node]
+                if sprites is not None:
+                    render.surface_pool.release(sprites)
+                self.dropped += 1
+                continue
+            del self.jobs[node]
+            if exc is not None:
+                error = error or exc
+                continue
+            node._raster_done(render, sprites)
+            swapped += 1
+        self.swapped += swapped
+        if error is not None:
+            # Ошибка растеризации всплывает в потоке UI, как без Rasterizer
+            raise error
+        return swapped
+
+    def forget(self, render):
+        """Забывает работу узлов закрываемого render"""
+        with self._lock:
+            done = self._done.pop(render, ())
+        for node in [node for node, job in self.jobs.items() if job[0] is render]:
+            del self.jobs[node]
+        for _node, _key, sprites, _exc in done:
+            if sprites is not None:
+                render.surface_pool.release(sprites)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.jobs = dict()
+
+    def stats(self):
+        return {
+            "submitted": self.submitted,
+            "swapped": self.swapped,
+            "dropped": self.dropped,
+            "pending": len(self.jobs),
+        }
+
+
+def rasterize_text(font_manager, pool, text, font, size, color):
+    """Надпись на поверхности из пула, [SoftwareSprite]"""
+    w, h = font_manager.text_size(text, font, size, color)
+    sprite = pool.surface(w, h)
+    font_manager.render_into(sprite.surface, text, alias=font, size=size, color=color)
+    return [sprite]
+
+
+def fill_surface(pool, size, color):
+    """Заливка панели на поверхности из пула, [SoftwareSprite]"""
+    # Как create_software_sprite: без альфа-канала, копируется
+    sprite = pool.surface(size[0], size[1], sdl2.SDL_PIXELFORMAT_RGB888)
+    sdl2.ext.fill(sprite, color)
+    return [sprite]
@@ -0,0 +1,304 @@
+import inspect
+import weakref
+
+from .main import UIPanel, UIText
+from .widgets import UIWidgetsFactory
+
+# Служебные ключи описания, не попадающие в kwargs фабрик
+DESCRIPTION_KEYS = ("type", "nodes")
+
+
+def element(type, pos, size=None, nodes=None, **kwargs):
+    """Описание узла для Reconciler: обычный словарь с теми же аргументами,
+    что у UIFactory.Panel/Text и методов UIWidgetsFactory, плюс
+    "type" — имя метода фабрики и "nodes" — описания детей.
+
+    element("Panel", (0, 0), (100, 20), [element("Text", ...)], color=(...))"""
+    description = dict(kwargs, type=type, pos=pos)
+    if size is not None:
+        description["size"] = size
+    if nodes is not None:
+        description["nodes"] = list(nodes)
+    return description
+
+
+def _set_panel_color(node, color):
+    node.color = color
+    node.nodes[0].color = color
+
+
+def _set_label_text(node, text):
+    node.text = text
+    node.set_text(text)
+
+
+def _set_label_color_text(node, color):
+    node.color_text = color
+    node.nodes[1].color = color
+
+
+def _set_button_text(node, text):
+    node.text = text
+    node.nodes[1].text = text
+
+
+def _set_button_color(node, color):
+    node.color = color
+    node.nodes[0].color = node.face_color()
+
+
+def _set_button_color_hover(node, color):
+    node.color_hover = color
+    node.nodes[0].color = node.face_color()
+
+
+def _set_button_color_press(node, color):
+    node.color_press = color
+    node.nodes[0].color = node.face_color()
+
+
+def _set_list_size(node, size):
+    node.size = size
+    node.nodes[0].size = size
+
+
+def _set_sprite(node, sprite):
+    if node.nodes:
+        node.update_sprite(sprite)
+    else:
+        node.set_sprite(sprite)
+
+
+def _set_data_source(node, data_source):
+    node.data_source = data_source
+    node.refresh()
+
+
+def _set_bind_row(node, bind_row):
+    node.bind_row = bind_row
+    node.refresh()
+
+
+def _set_grid_color(node, color):
+    node.color = color
+    node.fill(color)
+
+
+class Kind:
+    """Как создавать и обновлять узлы одного типа описания.
+
+    first_child — сколько первых детей узел создаёт сам (фон ElementsList),
+    None — дети целиком внутренние и в описании не задаются.
+    setters — свойства, которые меняются на месте особым образом.
+    Остальные свойства у узлов с детьми из описания присваиваются как есть,
+    у составных виджетов их изменение пересоздаёт узел."""
+
+    def __init__(self, factory, method, node_class, first_child=0, setters=None):
+        self.factory = factory
+        self.method = method
+        self.node_class = node_class
+        self.first_child = first_child
+        self.setters = setters or {}
+        self.positional = None
+
+    def create(self, ui_factory, widgets, props):
+        factory = ui_factory if self.factory == "ui" else widgets
+        method = getattr(factory, self.method)
+        if self.positional is None:
+            self.positional = [
+                param.name for param in inspect.signature(method).parameters.values()
+                if param.kind == param.POSITIONAL_OR_KEYWORD]
+        args = [None if name == "nodes" else props.get(name) for name in self.positional]
+        # Размер color_grid и elements_matrix фабрика считает сама
+        kwargs = {key: val for key, val in props.items()
+                  if key not in self.positional and key != "size"}
+        return method(*args, **kwargs)
+
+
+KINDS = {
+    "Panel": Kind("ui", "Panel", UIPanel),
+    "Text": Kind("ui", "Text", UIText),
+    "elements_list": Kind("widgets", "elements_list", UIWidgetsFactory.ElementsList, 1, {
+        "color": _set_panel_color,
+        "size": _set_list_size,
+    }),
+    "elements_matrix": Kind("widgets", "elements_matrix", UIWidgetsFactory.ElementsMatrix),
+    "elements_matrix_axis": Kind("widgets", "elements_matrix_axis",
+                                 UIWidgetsFactory.ElementsMatrixAxis),
+    "label": Kind("widgets", "label", UIWidgetsFactory.Label, None, {
+        "text": _set_label_text,
+        "color": _set_panel_color,
+        "color_text": _set_label_color_text,
+    }),
+    "button": Kind("widgets", "button", UIWidgetsFactory.Button, None, {
+        "text": _set_button_text,
+        "color": _set_button_color,
+        "color_hover": _set_button_color_hover,
+        "color_press": _set_button_color_press,
+        "click_event": setattr,
+    }),
+    "direct_sprite": Kind("widgets", "direct_sprite", UIWidgetsFactory.DirectSprite, None, {
+        "sprite": _set_sprite,
+    }),
+    "stream_image": Kind("widgets", "stream_image", UIWidgetsFactory.StreamImage, None),
+    "virtual_list": Kind("widgets", "virtual_list", UIWidgetsFactory.VirtualList, None, {
+        "data_source": _set_data_source,
+        "bind_row": _set_bind_row,
+        "scroll_pos": lambda node, scroll_pos: node.scroll_to(scroll_pos),
+    }),
+    "color_grid": Kind("widgets", "color_grid", UIWidgetsFactory.ColorGrid, None, {
+        "color": _set_grid_color,
+        "cell_click": setattr,
+    }),
+}
+# Свойства самого узла, не затрагивающие внутренних детей составных виджетов
+NODE_PROPS = frozenset(("pos", "align", "s_id", "clickable", "clip"))
+
+
+class Reconciler:
+    """Приводит детей узла к декларативному описанию (см. element()).
+
+    Дети сопоставляются с описаниями по s_id в пределах одного родителя,
+    описания без s_id — по порядку среди детей без s_id. Совпавший узел
+    того же типа обновляется: присваиваются только свойства, изменившиеся
+    с прошлого описания этого узла, поэтому спрайты пересоздаются лишь у
+    действительно изменившихся узлов. Свойства, пропавшие из описания,
+    возвращаются к значениям по умолчанию, как у нового узла. Остальные узлы создаются или
+    удаляются, список детей присваивается только при изменении состава
+    или порядка. Перенос узла с s_id к другому родителю — удаление
+    и создание. Обработчики в описании лучше передавать одни и те же
+    объекты: новая lambda на каждом описании считается изменением."""
+
+    def __init__(self, ui_factory, widgets=None):
+        self.ui_factory = ui_factory
+        self.widgets = widgets or UIWidgetsFactory(ui_factory)
+        self.descriptions = weakref.WeakKeyDictionary()  # node -> свойства прошлого описания
+        self.stats = dict()
+
+    def reconcile(self, parent, descriptions):
+        """Приводит детей parent к списку описаний descriptions.
+        Возвращает счётчики created, updated, replaced, removed, moved"""
+        self.stats = dict.fromkeys(("created", "updated", "replaced", "removed", "moved"), 0)
+        kind = self._kind_of_node(parent)
+        first_child = kind.first_child if kind else 0
+        if first_child is None:
+            raise ValueError("%s has no reconcilable children" % type(parent).__name__)
+        self._reconcile_children(parent, first_child, descriptions)
+        return self.stats
+
+    def create(self, description):
+        """Строит новое поддерево по описанию"""
+        kind = KINDS[description["type"]]
+        props = self._props(description)
+        node = kind.create(self.ui_factory, self.widgets, props)
+        self.descriptions[node] = props
+        self.stats["created"] = self.stats.get("created", 0) + 1
+        children = description.get("nodes")
+        if children:
+            self._check_children(kind, description)
+            node.nodes = list(node.nodes[:kind.first_child]) + [
+                self.create(child) for child in children]
+        return node
+
+    @staticmethod
+    def _props(description):
+        return {key: val for key, val in description.items()
+                if key not in DESCRIPTION_KEYS}
+
+    @staticmethod
+    def _kind_of_node(node):
+        for kind in KINDS.values():
+            if type(node) is kind.node_class:
+                return kind
+        return None
+
+    @staticmethod
+    def _check_children(kind, description):
+        if kind.first_child is None and description.get("nodes"):
+            raise ValueError("%s does not take nodes in a description" % description["type"])
+
+    def _reconcile_children(self, parent, first_child, descriptions):
+        old_children = list(parent.nodes[first_child:])
+        keyed = dict()
+        unkeyed = list()
+        for node in old_children:
+            if node.s_id and node.s_id not in keyed:
+                keyed[node.s_id] = node
+            else:
+                unkeyed.append(node)
+        unkeyed.reverse()
+
+        children = list()
+        for description in descriptions:
+            kind = KINDS[description["type"]]
+            s_id = description.get("s_id")
+            if s_id:
+                node = keyed.pop(s_id, None)
+            else:
+                node = unkeyed.pop() if unkeyed else None
+            if node is not None and type(node) is kind.node_class:
+                node = self._update(node, kind, description)
+            else:
+                node = self.create(description)
+            children.append(node)
+
+        if len(children) == len(old_children) and all(
+                new is old for new, old in zip(children, old_children)):
+            return
+        reused = set(children)
+        self.stats["removed"] += sum(1 for node in old_children if node not in reused)
+        old_index = {node: index for index, node in enumerate(old_children)}
+        kept = [old_index[node] for node in children if node in old_index]
+        self.stats["moved"] += sum(1 for a, b in zip(kept, kept[1:]) if a > b)
+        parent.nodes = list(parent.nodes[:first_child]) + children
+
+    def _update(self, node, kind, description):
+        props = self._props(description)
+        old_props = self.descriptions.get(node)
+        if old_props is None:
+            # Узел построен не Reconciler: сравниваем с текущими значениями
+            old_props = {key: getattr(node, key, None) for key in props}
+        changed = {key: val for key, val in props.items()
+                   if key not in old_props or old_props[key] != val}
+        removed = old_props.keys() - props.keys()
+
+        if kind.first_child is None and any(
+                key not in kind.setters and key not in NODE_PROPS for key in changed) or \
+                any(key == "hover" or kind.first_child is None and key not in NODE_PROPS
+                    for key in removed):
+            # Составной виджет, свойство которого нельзя поменять на месте,
+            # или пропавший hover: узел может остаться в Render.hovered_path
+            self.stats["replaced"] += 1
+            return self.create(description)
+
+        for key, val in changed.items():
+            self._set(node, kind, key, val)
+        for key in removed:
+            self._reset(node, kind, key)
+        if changed or removed:
+            self.stats["updated"] += 1
+        self.descriptions[node] = props
+
+        if kind.first_child is not None:
+            self._reconcile_children(node, kind.first_child, description.get("nodes", ()))
+        else:
+            self._check_children(kind, description)
+        return node
+
+    @staticmethod
+    def _set(node, kind, key, val):
+        setter = kind.setters.get(key)
+        if setter is None or setter is setattr:
+            setattr(node, key, val)
+        else:
+            setter(node, val)
+
+    def _reset(self, node, kind, key):
+        """Свойство, пропавшее из описания, получает значение по умолчанию"""
+        if key in node._defaults:
+            self._set(node, kind, key, node._defaults[key])
+        elif key in getattr(node, "__dict__", ()):
+            # Снова виден атрибут класса (clickable, align, обработчики)
+            delattr(node, key)
+            if key in node.redraw_props or key in node.layout_props:
+                node.mark_dirty(key in node.layout_props)
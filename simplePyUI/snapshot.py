@@ -0,0 +1,305 @@
+"""Снимок построенного дерева в файл для быстрого запуска.
+
+    snapshot.save(render, "ui.snap", key="1.4")
+    loaded = snapshot.load("ui.snap", UIFactory(window),
+                           handlers={"ok": {"click_event": on_ok}},
+                           key="1.4", font_path=font_path)
+    render = Render(window, loaded.root, font_path, hit_grid=loaded.hit_grid)
+
+В файле лежат поля узлов с готовой раскладкой (pickle, см.
+UINode.__getstate__), Render.hit_grid, уже растеризованные надписи UIText
+и пиксели пользовательских SoftwareSprite. load() отображает файл в память
+(mmap), поэтому поверхности надписей смотрят прямо в страницы файла,
+а первый кадр не раскладывает дерево и не растеризует текст.
+
+Обработчики, которые нельзя сохранить по имени модуля (lambda, замыкания,
+методы не-узлов), в файл не попадают: load() берёт их из handlers по s_id
+узла и имени поля. Не найденные возвращаются списком unbound. Поле, где
+такой обработчик лежит внутри tuple, list или dict, берётся из handlers
+целиком; обработчик внутри любого другого объекта восстановить нельзя,
+и save() такое дерево не сохраняет.
+Снимок — pickle: загружайте только файлы, записанные своим приложением."""
+import collections
+import ctypes
+import functools
+import inspect
+import io
+import json
+import mmap
+import os
+import pickle
+import struct
+import types
+
+import sdl2
+import sdl2.ext
+
+from .abstarct_classes import AbstarctUIFactory
+from .main import UINode, UIText
+
+MAGIC = b"SPUISNAP"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQ")  # magic, version, длина meta, длина дерева
+ALIGN = 64  # Выравнивание начала пикселей в файле
+# Типы, которые persistent_id пропускает без проверок
+PLAIN_TYPES = frozenset((int, float, str, bytes, bool, tuple, list, dict, type(None)))
+
+# unbound — [(s_id, поле), ...] обработчиков, которых не нашлось в handlers
+Snapshot = collections.namedtuple("Snapshot", ("root", "hit_grid", "unbound"))
+
+
+def _importable(fn):
+    target = inspect.getmodule(fn)
+    for name in fn.__qualname__.split("."):
+        target = getattr(target, name, None)
+    return target is fn
+
+
+def _is_callback(obj):
+    """Обработчик, который pickle не сохранит по имени"""
+    kind = type(obj)
+    if kind is types.MethodType:
+        return not isinstance(obj.__self__, UINode)
+    if kind is types.FunctionType:
+        return not _importable(obj)
+    return kind is functools.partial
+
+
+def _find_callbacks(val, found, seen=None):
+    """Дописывает в found обработчики из val и вложенных в него tuple, list, dict"""
+    if _is_callback(val):
+        found.append(val)
+        return found
+    kind = type(val)
+    if kind is tuple or kind is list or kind is dict:
+        seen = seen if seen is not None else set()
+        if id(val) in seen:
+            return found
+        seen.add(id(val))
+        for item in val.values() if kind is dict else val:
+            _find_callbacks(item, found, seen)
+    return found
+
+
+class _Pickler(pickle.Pickler):
+
+    def __init__(self, file, pixels):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.pixels = pixels
+        self.callbacks = list()  # Все обработчики, заменённые на None
+
+    def persistent_id(self, obj):
+        if type(obj) in PLAIN_TYPES:
+            return None
+        if isinstance(obj, AbstarctUIFactory):
+            return ("ui_factory",)
+        if isinstance(obj, sdl2.ext.SoftwareSprite):
+            return ("surface",) + self.pixels.add_surface(obj.surface)
+        if isinstance(obj, sdl2.ext.TextureSprite):
+            raise TypeError("texture sprites can't be saved in a snapshot")
+        if _is_callback(obj):
+            self.callbacks.append(obj)
+            return ("callback",)
+        return None
+
+
+class _Unpickler(pickle.Unpickler):
+
+    def __init__(self, file, ui_factory, surfaces):
+        super().__init__(file)
+        self.ui_factory = ui_factory
+        self.surfaces = surfaces
+
+    def persistent_load(self, pid):
+        if pid[0] == "ui_factory":
+            return self.ui_factory
+        if pid[0] == "surface":
+            return self.surfaces(*pid[1:])
+        if pid[0] == "callback":
+            return None
+        raise pickle.UnpicklingError("unknown persistent id %r" % (pid,))
+
+
+class _Pixels:
+    """Пиксели снимка: одинаковые картинки пишутся один раз"""
+
+    def __init__(self):
+        self.chunks = list()
+        self.size = 0
+        self.offsets = dict()  # байты -> смещение
+
+    def add(self, data):
+        offset = self.offsets.get(data)
+        if offset is None:
+            offset = self.offsets[data] = self.size
+            self.chunks.append(data)
+            self.size += len(data)
+        return offset
+
+    def add_surface(self, surface):
+        """(смещение, w, h, pitch) поверхности, приведённой к ARGB8888"""
+        converted = None
+        if surface.format.contents.format != sdl2.SDL_PIXELFORMAT_ARGB8888:
+            converted = sdl2.SDL_ConvertSurfaceFormat(
+                surface, sdl2.SDL_PIXELFORMAT_ARGB8888, 0)
+            if not converted:
+                raise sdl2.ext.SDLError()
+            surface = converted.contents
+        try:
+            sdl2.SDL_LockSurface(surface)
+            data = ctypes.string_at(surface.pixels, surface.pitch * surface.h)
+            sdl2.SDL_UnlockSurface(surface)
+        finally:
+            if converted:
+                sdl2.SDL_FreeSurface(converted)
+        return (self.add(data), surface.w, surface.h, surface.pitch)
+
+
+def _walk(root):
+    # Тот же порядок обхода при сохранении и загрузке
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(reversed(node.nodes))
+
+
+def save(render, path, key=None, handlers=None):
+    """Сохраняет дерево render.start_ui_node вместе с картинками надписей.
+
+    handlers — те же, что будут переданы в load(): если для какого-то поля
+    с обработчиком в них ничего нет, снимок не восстановится, и save()
+    бросает ValueError со списком (s_id, поле). TypeError, если обработчик
+    лежит внутри объекта, откуда load() его не вернёт.
+    Возвращает {"nodes", "texts", "bytes"}"""
+    render.layout()
+    font_manager, pool = render.font_manager, render.surface_pool
+    pixels = _Pixels()
+    texts = list()  # (узел, положение картинки в пикселях)
+    callbacks = list()  # (узел, поле)
+    restored = set()  # id обработчиков, которые load() вернёт через handlers
+    nodes = 0
+    for node in _walk(render.start_ui_node):
+        nodes += 1
+        for field, val in node.__getstate__().items():
+            found = _find_callbacks(val, [])
+            if found:
+                callbacks.append((node, field))
+                restored.update(id(callback) for callback in found)
+        if not isinstance(node, UIText) or not node.text:
+            continue
+        try:
+            w, h = font_manager.text_size(node.text, node.font, node.text_size, node.color)
+        except ValueError:
+            # Некорректный цвет: узел и без снимка не нарисуется
+            continue
+        sprite = pool.surface(w, h)
+        font_manager.render_into(sprite.surface, node.text, alias=node.font,
+                                 size=node.text_size, color=node.color)
+        texts.append((node, pixels.add_surface(sprite.surface)))
+        pool.release((sprite,))
+
+    if handlers is not None:
+        unbound = [(node.s_id, field) for node, field in callbacks
+                   if handlers.get(node.s_id, {}).get(field) is None]
+        if unbound:
+            raise ValueError("no handlers for %r, the snapshot can't be restored" % unbound)
+
+    tree = io.BytesIO()
+    pickler = _Pickler(tree, pixels)
+    # Списки ссылаются на те же узлы, что и дерево: при загрузке
+    # их не надо искать обходом
+    pickler.dump({"root": render.start_ui_node, "hit_grid": render.hit_grid,
+                  "texts": texts, "callbacks": callbacks})
+    lost = [callback for callback in pickler.callbacks if id(callback) not in restored]
+    if lost:
+        raise TypeError("handlers %r are nested in objects a snapshot can't restore" % lost)
+    tree = tree.getbuffer()
+    meta = json.dumps({"key": None if key is None else str(key),
+                       "font": render.font_path,
+                       "pixels": pixels.size}).encode()
+
+    start = HEADER.size + len(meta) + len(tree)
+    padding = -start % ALIGN
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "wb") as file:
+            file.write(HEADER.pack(MAGIC, VERSION, len(meta), len(tree)))
+            file.write(meta)
+            file.write(tree)
+            file.write(bytes(padding))
+            for chunk in pixels.chunks:
+                file.write(chunk)
+        os.replace(tmp_path, path)
+    except OSError:
+        # Недописанный файл не оставляем
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return {"nodes": nodes, "texts": len(texts), "bytes": start + padding + pixels.size}
+
+
+def load(path, ui_factory, handlers=None, key=None, font_path=None):
+    """Восстанавливает дерево из файла save().
+
+    handlers = {s_id: {"click_event": fun, "hover": (fun, fun), ...}}
+    Возвращает Snapshot; поля обработчиков из unbound остаются
+    по умолчанию. None, если файла нет, он другой версии или записан
+    с другим key или font_path"""
+    try:
+        file = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    with file:
+        try:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+        except ValueError:
+            # Пустой файл
+            return None
+    if len(data) < HEADER.size:
+        return None
+    magic, version, meta_len, tree_len = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        return None
+    meta = json.loads(bytes(data[HEADER.size:HEADER.size + meta_len]))
+    if meta["key"] != (None if key is None else str(key)) or \
+            font_path is not None and meta["font"] != font_path:
+        return None
+
+    start = HEADER.size + meta_len
+    pixels_start = start + tree_len + (-(start + tree_len) % ALIGN)
+    # Поверхности смотрят прямо в отображённый файл; буфер держит mmap живым,
+    # пока на него ссылается хоть один спрайт
+    buffer = (ctypes.c_char * meta["pixels"]).from_buffer(data, pixels_start) \
+        if meta["pixels"] else None
+
+    def surface(offset, w, h, pitch):
+        sdl_surface = sdl2.SDL_CreateRGBSurfaceWithFormatFrom(
+            ctypes.addressof(buffer) + offset, w, h, 32, pitch,
+            sdl2.SDL_PIXELFORMAT_ARGB8888)
+        if not sdl_surface:
+            raise sdl2.ext.SDLError()
+        sdl2.SDL_SetSurfaceBlendMode(sdl_surface, sdl2.SDL_BLENDMODE_BLEND)
+        sprite = sdl2.ext.SoftwareSprite(sdl_surface.contents, True)
+        sprite.snapshot_buffer = buffer
+        return sprite
+
+    tree = io.BytesIO(data[start:start + tree_len])
+    state = _Unpickler(tree, ui_factory, surface).load()
+    for node, text in state["texts"]:
+        # Поверхность создаётся при первой отрисовке узла
+        node._prerendered = functools.partial(surface, *text)
+
+    unbound = list()
+    handlers = handlers or {}
+    for node, key in state["callbacks"]:
+        handler = handlers.get(node.s_id, {}).get(key)
+        if handler is not None:
+            object.__setattr__(node, key, handler)
+            continue
+        unbound.append((node.s_id, key))
+        if key in node._defaults:
+            object.__setattr__(node, key, node._defaults[key])
+        else:
+            delattr(node, key)
+    return Snapshot(state["root"], state["hit_grid"], unbound)
@@ -0,0 +1,77 @@
+import bisect
+import collections
+
+CELL_SIZE = 64
+
+
+class HitGrid:
+    """Равномерная сетка над абсолютными прямоугольниками узлов.
+
+    В каждой ячейке лежат (order, id(node), rect, node), отсортированные по order —
+    номеру узла при прямом обходе дерева. Из попавших под точку узлов верхним
+    считается узел с наибольшим order: его же первым находит обход
+    UINode.handle_mouse_event (дети в обратном порядке, затем сам узел)."""
+
+    def __init__(self, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = collections.defaultdict(list)
+        self.entries = dict()  # node -> (order, rect)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getstate__(self):
+        # В ячейках лежат id() узлов: после загрузки их пересчитываем
+        return {"cell_size": self.cell_size, "entries": self.entries}
+
+    def __setstate__(self, state):
+        self.cell_size = state["cell_size"]
+        self.entries = state["entries"]
+        self.cells = collections.defaultdict(list)
+        for node, (order, rect) in self.entries.items():
+            for cell in self._cells_of(rect):
+                self.cells[cell].append((order, id(node), rect, node))
+        for items in self.cells.values():
+            items.sort()
+
+    def clear(self):
+        self.cells.clear()
+        self.entries.clear()
+
+    def _cells_of(self, rect):
+        size = self.cell_size
+        x, y, w, h = rect
+        for cell_x in range(x // size, (x + w) // size + 1):
+            for cell_y in range(y // size, (y + h) // size + 1):
+                yield (cell_x, cell_y)
+
+    def insert(self, node, rect, order):
+        if node in self.entries:
+            self.remove(node)
+        if rect[2] <= 0 or rect[3] <= 0:
+            return
+        self.entries[node] = (order, rect)
+        for cell in self._cells_of(rect):
+            bisect.insort(self.cells[cell], (order, id(node), rect, node))
+
+    def remove(self, node):
+        entry = self.entries.pop(node, None)
+        if entry is None:
+            return
+        order, rect = entry
+        for cell in self._cells_of(rect):
+            items = self.cells[cell]
+            i = bisect.bisect_left(items, (order, id(node)))
+            if i < len(items) and items[i][3] is node:
+                del items[i]
+            if not items:
+                del self.cells[cell]
+
+    def query(self, pos):
+        """Верхний узел, строго содержащий точку pos, или None"""
+        x, y = pos
+        items = self.cells.get((x // self.cell_size, y // self.cell_size), ())
+        for _order, _node_id, rect, node in reversed(items):
+            if rect[0] < x < rect[0] + rect[2] and rect[1] < y < rect[1] + rect[3]:
+                return node
+        return None
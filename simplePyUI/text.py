@@ -0,0 +1,269 @@
+import collections
+import ctypes
+import threading
+
+import sdl2
+import sdl2.ext
+import sdl2.sdlttf
+
+ATLAS_PAGE_SIZE = 512
+MAX_ATLASES = 32  # Сочетаний (шрифт, размер, цвет) в памяти одновременно
+MAX_LAYOUTS = 4096  # Строк в LRU-кэше раскладок
+
+
+def _create_surface(w, h):
+    surface = sdl2.SDL_CreateRGBSurfaceWithFormat(
+        0, w, h, 32, sdl2.SDL_PIXELFORMAT_ARGB8888)
+    if not surface:
+        raise sdl2.ext.SDLError()
+    return surface.contents
+
+
+class GlyphAtlas:
+    """Глифы одного шрифта (alias, size, color), уложенные полками
+    на общие страницы-поверхности"""
+
+    def __init__(self, page_size=ATLAS_PAGE_SIZE):
+        self.page_size = page_size
+        self.pages = list()
+        # char -> (page, SDL_Rect, minx, advance) | None для символов без глифа;
+        # page = None у глифов без пикселей (пробел)
+        self.glyphs = dict()
+        self._x = self._y = self._row_h = 0
+
+    def add(self, char, glyph_surface, ink_x, ink_w, minx, advance):
+        """Копирует в атлас столбцы [ink_x, ink_x + ink_w) glyph_surface:
+        только сам глиф, без полей до начала и после конца штриха"""
+        w, h = ink_w, glyph_surface.h
+        if w <= 0:
+            self.glyphs[char] = (None, sdl2.SDL_Rect(0, 0, 0, h), minx, advance)
+            return self.glyphs[char]
+        if not self.pages or self._x + w > self.pages[-1].w:
+            self._x = 0
+            self._y += self._row_h
+            self._row_h = 0
+        if not self.pages or self._y + h > self.pages[-1].h:
+            page = _create_surface(max(w, self.page_size), max(h, self.page_size))
+            sdl2.SDL_SetSurfaceBlendMode(page, sdl2.SDL_BLENDMODE_NONE)
+            self.pages.append(page)
+            self._x = self._y = self._row_h = 0
+
+        page = self.pages[-1]
+        rect = sdl2.SDL_Rect(self._x, self._y, w, h)
+        sdl2.SDL_SetSurfaceBlendMode(glyph_surface, sdl2.SDL_BLENDMODE_NONE)
+        sdl2.SDL_BlitSurface(glyph_surface, sdl2.SDL_Rect(ink_x, 0, w, h),
+                             page, sdl2.SDL_Rect(rect.x, rect.y))
+        self._x += w
+        self._row_h = max(self._row_h, h)
+        self.glyphs[char] = (page, rect, minx, advance)
+        return self.glyphs[char]
+
+    def memory(self):
+        return sum(page.pitch * page.h for page in self.pages)
+
+    def free(self):
+        for page in self.pages:
+            sdl2.SDL_FreeSurface(page)
+        self.pages = list()
+        self.glyphs = dict()
+
+
+class GlyphFontManager(sdl2.ext.FontManager):
+    """FontManager, собирающий строки из закэшированных глифов.
+
+    Каждый глиф растеризуется SDL_ttf один раз на (alias, size, color) и
+    хранится в атласе. Раскладка строки (смещения глифов, ширина и высота)
+    кэшируется в LRU, поэтому новая строка из уже встреченных символов
+    собирается только копированием прямоугольников из атласа.
+    Глифы расставляются по advance и minx из TTF_GlyphMetrics32 с кернингом
+    пар из TTF_GetFontKerningSizeGlyphs32. SDL_ttf с HarfBuzz берёт кернинг
+    из GPOS и дробные смещения, поэтому ширина может отличаться от
+    TTF_SizeUTF8 на пиксель-другой.
+
+    Кэши и SDL_ttf не потокобезопасны: render, text_size и render_into
+    выполняются под блокировкой lock (см. raster.Rasterizer)."""
+
+    def __init__(self, font_path, alias=None, size=16, max_atlases=MAX_ATLASES,
+                 max_layouts=MAX_LAYOUTS, **kwargs):
+        super().__init__(font_path, alias, size, **kwargs)
+        self.max_atlases = max_atlases
+        self.max_layouts = max_layouts
+        self.atlases = collections.OrderedDict()
+        self.layouts = collections.OrderedDict()
+        self.lock = threading.RLock()
+
+        self.glyph_hits = 0
+        self.glyph_misses = 0
+        self.layout_hits = 0
+        self.layout_misses = 0
+        self.atlas_evictions = 0
+        self.layout_evictions = 0
+
+    def render(self, text, alias=None, size=None, width=None, color=None,
+               bg_color=None, **kwargs):
+        with self.lock:
+            if width or bg_color is not None or kwargs:
+                # Перенос строк и непрозрачный фон рисует сам SDL_ttf
+                return super().render(text, alias, size, width, color, bg_color, **kwargs)
+
+            font_key = self._font_key(alias, size, color)
+            atlas = self._get_atlas(font_key)
+            text_w, text_h, offsets = self._get_layout(font_key, atlas, text)
+            surface = _create_surface(max(text_w, 1), max(text_h, 1))
+            self._clear(surface, font_key)
+            self._draw(surface, font_key, atlas, text, offsets)
+            return surface
+
+    def text_size(self, text, alias=None, size=None, color=None):
+        """Размер поверхности, которую render() вернёт для text"""
+        font_key = self._font_key(alias, size, color)
+        with self.lock:
+            text_w, text_h, _offsets = self._get_layout(
+                font_key, self._get_atlas(font_key), text)
+        return max(text_w, 1), max(text_h, 1)
+
+    def render_into(self, surface, text, alias=None, size=None, color=None):
+        """Как render(), но рисует в готовую поверхность ARGB8888 размером
+        text_size(): прежнее содержимое стирается до прозрачного"""
+        font_key = self._font_key(alias, size, color)
+        self._clear(surface, font_key)
+        with self.lock:
+            atlas = self._get_atlas(font_key)
+            _text_w, _text_h, offsets = self._get_layout(font_key, atlas, text)
+            self._draw(surface, font_key, atlas, text, offsets)
+        return surface
+
+    def _font_key(self, alias, size, color):
+        if color is not None:
+            color = sdl2.ext.convert_to_color(color)
+            color = (color.r, color.g, color.b, color.a)
+        return (alias or self.default_font, size or self.size, color)
+
+    def _clear(self, surface, font_key):
+        """Прозрачный фон цвета текста: глифы, наложенные кернингом,
+        смешиваются с ним без тёмной каймы"""
+        color = font_key[2] or self._textcolor
+        if not isinstance(color, tuple):
+            color = (color.r, color.g, color.b)
+        pixel = sdl2.SDL_MapRGBA(surface.format, color[0], color[1], color[2], 0)
+        sdl2.SDL_FillRect(surface, None, pixel)
+
+    def _draw(self, surface, font_key, atlas, text, offsets):
+        dst = sdl2.SDL_Rect()
+        right = 0
+        for char, x in zip(text, offsets):
+            glyph = self._get_glyph(font_key, atlas, char)
+            if glyph is None or glyph[0] is None:
+                continue
+            page, rect, _minx, _advance = glyph
+            # Перекрытый соседом глиф смешивается, остальные просто копируются
+            sdl2.SDL_SetSurfaceBlendMode(
+                page, sdl2.SDL_BLENDMODE_BLEND if x < right else sdl2.SDL_BLENDMODE_NONE)
+            dst.x, dst.y = x, 0
+            sdl2.SDL_BlitSurface(page, rect, surface, dst)
+            right = max(right, x + rect.w)
+
+    def _get_atlas(self, font_key):
+        atlas = self.atlases.get(font_key)
+        if atlas is not None:
+            self.atlases.move_to_end(font_key)
+            return atlas
+        atlas = self.atlases[font_key] = GlyphAtlas()
+        while len(self.atlases) > self.max_atlases:
+            _key, evicted = self.atlases.popitem(last=False)
+            evicted.free()
+            self.atlas_evictions += 1
+        return atlas
+
+    def _get_glyph(self, font_key, atlas, char):
+        if char in atlas.glyphs:
+            self.glyph_hits += 1
+            return atlas.glyphs[char]
+        self.glyph_misses += 1
+        alias, size, color = font_key
+        try:
+            glyph_surface = super().render(char, alias, size, color=color)
+        except sdl2.ext.SDLError:
+            # Символ нулевой ширины (перевод строки и т.п.)
+            atlas.glyphs[char] = None
+            return None
+        try:
+            minx = ctypes.c_int()
+            maxx = ctypes.c_int()
+            advance = ctypes.c_int()
+            font = self.fonts[alias][size]
+            if sdl2.sdlttf.TTF_GlyphMetrics32(
+                    font, ord(char), ctypes.byref(minx), ctypes.byref(maxx),
+                    None, None, ctypes.byref(advance)) != 0:
+                minx.value, maxx.value, advance.value = 0, glyph_surface.w, glyph_surface.w
+            # Поверхность SDL_ttf начинается в min(0, minx) от пера
+            ink_x = max(minx.value, 0)
+            ink_w = min(maxx.value - minx.value, glyph_surface.w - ink_x)
+            glyph = atlas.add(char, glyph_surface, ink_x, ink_w, minx.value, advance.value)
+        finally:
+            sdl2.SDL_FreeSurface(glyph_surface)
+        return glyph
+
+    def _get_layout(self, font_key, atlas, text):
+        layout_key = (font_key, text)
+        layout = self.layouts.get(layout_key)
+        if layout is not None:
+            self.layouts.move_to_end(layout_key)
+            self.layout_hits += 1
+            return layout
+        self.layout_misses += 1
+
+        alias, size, _color = font_key
+        x = left = right = text_h = 0
+        prev = None
+        offsets = list()
+        for char in text:
+            glyph = self._get_glyph(font_key, atlas, char)
+            if glyph is None:
+                offsets.append(x)
+                continue
+            page, rect, minx, advance = glyph
+            font = self.fonts[alias][size]
+            if prev is not None and sdl2.sdlttf.TTF_GetFontKerning(font):
+                x += sdl2.sdlttf.TTF_GetFontKerningSizeGlyphs32(font, prev, ord(char))
+            prev = ord(char)
+            offsets.append(x + minx)
+            if page is not None:
+                left = min(left, x + minx)
+                right = max(right, x + minx + rect.w)
+            x += advance
+            right = max(right, x)
+            text_h = max(text_h, rect.h)
+
+        # Выступающий влево первый глиф сдвигает всю строку, как в SDL_ttf
+        offsets = tuple(offset - left for offset in offsets)
+        layout = self.layouts[layout_key] = (right - left, text_h, offsets)
+        while len(self.layouts) > self.max_layouts:
+            self.layouts.popitem(last=False)
+            self.layout_evictions += 1
+        return layout
+
+    def memory(self):
+        """Байт, занятых страницами атласов"""
+        return sum(atlas.memory() for atlas in self.atlases.values())
+
+    def stats(self):
+        return {
+            "glyph_hits": self.glyph_hits,
+            "glyph_misses": self.glyph_misses,
+            "layout_hits": self.layout_hits,
+            "layout_misses": self.layout_misses,
+            "atlas_evictions": self.atlas_evictions,
+            "layout_evictions": self.layout_evictions,
+            "atlases": len(self.atlases),
+            "glyphs": sum(len(atlas.glyphs) for atlas in self.atlases.values()),
+            "layouts": len(self.layouts),
+            "memory": self.memory(),
+        }
+
+    def close(self):
+        for atlas in getattr(self, "atlases", {}).values():
+            atlas.free()
+        self.atlases = collections.OrderedDict()
+        self.layouts = collections.OrderedDict()
+        super().close()
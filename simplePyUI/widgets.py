@@ -1,8 +1,19 @@
+import array
+import ctypes
 import enum
+import math
+
+import sdl2
+import sdl2.ext
 
 from .main import UINode, UIPanel, UIText, Render, ALIGN
 from .abstarct_classes import AbstarctUIFactory
 
+WHEEL_ROWS = 3  # Строк виртуального списка за один щелчок колеса
+# Упакованные YUV, которые StreamImage.write читает построчно, как RGB
+PACKED_YUV_FORMATS = frozenset((sdl2.SDL_PIXELFORMAT_YUY2, sdl2.SDL_PIXELFORMAT_UYVY,
+                                sdl2.SDL_PIXELFORMAT_YVYU))
+
 
 class STATE(enum.IntEnum):
     NONE = 0
@@ -11,13 +22,100 @@ class STATE(enum.IntEnum):
     CHECK = 4
 
 
+def pack_color(color):
+    """(r, g, b, a) -> 0xAARRGGBB (SDL_PIXELFORMAT_ARGB8888)"""
+    r, g, b, *a = color
+    a = a[0] if a else 255
+    return (a << 24) | (r << 16) | (g << 8) | b
+
+
+def unpack_color(value):
+    return ((value >> 16) & 0xFF, (value >> 8) & 0xFF, value & 0xFF, value >> 24)
+
+
+def _pixels_address(pixels):
+    """(адрес, шаг строк | None, байт от адреса, владелец адреса) буфера
+    pixels без копирования. Владельца надо держать, пока адрес нужен"""
+    interface = getattr(pixels, "__array_interface__", None)
+    if interface is not None:
+        # numpy, в том числе срезы кадра с шагом строк больше их длины
+        address = interface["data"][0]
+        shape = interface["shape"]
+        strides = interface.get("strides")
+        row = int(interface["typestr"][2:])
+        if strides is None:
+            row *= math.prod(shape[1:])
+            return address, row if len(shape) > 1 else None, row * shape[0], pixels
+        for dim, stride in zip(reversed(shape[1:]), reversed(strides[1:])):
+            if stride != row:
+                raise ValueError("pixels in a row must be contiguous")
+            row *= dim
+        if len(shape) < 2 or strides[0] < row:
+            raise ValueError("pixels rows must go down with a positive stride")
+        return address, strides[0], (shape[0] - 1) * strides[0] + row, pixels
+    if type(pixels) is bytes:
+        # c_char_p смотрит прямо в память bytes
+        address = ctypes.cast(ctypes.c_char_p(pixels), ctypes.c_void_p).value
+        return address, None, len(pixels), pixels
+    view = memoryview(pixels)
+    if not view.c_contiguous:
+        raise ValueError("pixels buffer must be contiguous")
+    if view.readonly:
+        # Адрес другого неизменяемого буфера ctypes даёт только через копию
+        buffer = (ctypes.c_char * view.nbytes).from_buffer_copy(view)
+    else:
+        buffer = (ctypes.c_char * view.nbytes).from_buffer(view)
+    pitch = view.strides[0] if view.ndim > 1 else None
+    return ctypes.addressof(buffer), pitch, view.nbytes, buffer
+
+
 class UIWidgetsFactory:
 
     def __init__(self, ui_factory: AbstarctUIFactory):
         self.ui_factory = ui_factory
 
+    class ButtonPanel(UIPanel):
+        """Фон кнопки: обработчики общие для всех кнопок и берут цвета
+        и click_event у родителя-Button"""
+
+        __slots__ = ()
+
+        def mouse_down(self):
+            button = self.parent
+            button.status = button.status | STATE.PRESS
+            self.color = button.color_press
+
+        def mouse_up(self):
+            button = self.parent
+            button.status = button.status & ~ STATE.PRESS
+            self.color = button.color_hover
+
+        def mouse_click(self):
+            return self.parent.click_event()
+
+        def click_event(self):
+            return self.parent.click_event()
+
+        def mouse_in(self):
+            button = self.parent
+            button.status = button.status | STATE.HOVER
+            if not button.status & STATE.PRESS:
+                self.color = button.color_hover
+
+        def mouse_out(self):
+            button = self.parent
+            button.status = button.status & ~ (STATE.PRESS | STATE.HOVER)
+            self.color = button.color
+
+        @property
+        def hover(self):
+            return (self.mouse_in, self.mouse_out)
+
     class Button(UINode):
 
+        __slots__ = ("ui_factory", "text", "color_text", "color", "color_hover",
+                     "color_press", "click_event", "status", "text_align", "text_size")
+
         ui_factory = AbstarctUIFactory
         text = str()
         color_text = tuple()
@@ -35,51 +133,27 @@ class UIWidgetsFactory:
         def __init__(self, pos, size, nodes,  **kwargs):
             super().__init__(pos, size, nodes, **kwargs)
 
-            panel: UIPanel = self.ui_factory.Panel(
-                (0, 0), self.size, [], color=self.color)
+            panel = UIWidgetsFactory.ButtonPanel((0, 0), self.size, [], color=self.color)
             text: UIText = self.ui_factory.Text((0, 0), self.size, [
             ], color=self.color_text, text=self.text, text_align=self.text_align, text_size=self.text_size)
 
-            def mouse_down():
-                self.status = self.status | STATE.PRESS
-                panel.color = self.color_press
-                # self.click_event()
-
-            def mouse_up():
-                self.status = self.status & ~ STATE.PRESS
-                panel.color = self.color_hover
-
-            def mouse_click():
-                self.click_event()
-
-
-            panel.mouse_down = mouse_down
-            panel.mouse_up = mouse_up
-            panel.mouse_click = mouse_click
-
-            def click():
-                self.click_event()
-            panel.click_event = click
-
-            def mouse_in():
-                if not self.status & STATE.PRESS:
-                    panel.color = self.color_hover
-
-            def mouse_out():
-                self.status = self.status & ~ STATE.PRESS
-                panel.color = self.color
-            panel.hover = (mouse_in, mouse_out)
-
             self.nodes = [panel, text]
 
+        def face_color(self):
+            """Цвет фона для текущего status: нажата, под курсором или нет"""
+            if self.status & STATE.PRESS:
+                return self.color_press
+            if self.status & STATE.HOVER:
+                return self.color_hover
+            return self.color
+
         def create_sprites(self, render: Render, pos_off=(0, 0)):
-            sprites = list()
-            for node in self.nodes:
-                sprites.extend(node.create_sprites(render, pos_off))
-            return sprites
+            return []
 
     class Label(UINode):
 
+        __slots__ = ("ui_factory", "text", "color_text", "color", "text_align", "text_size")
+
         ui_factory = AbstarctUIFactory
         text = str()
         color_text = tuple()
@@ -101,14 +175,13 @@ class UIWidgetsFactory:
             self.nodes[1].text = text
 
         def create_sprites(self, render: Render, pos_off=(0, 0)):
-            sprites = list()
-            for node in self.nodes:
-                sprites.extend(node.create_sprites(render, pos_off))
-            return sprites
+            return []
 
 
     class DirectSprite(UINode):
 
+        __slots__ = ("ui_factory", "sprite")
+
         ui_factory = AbstarctUIFactory
         sprite = None
 
@@ -128,32 +201,45 @@ class UIWidgetsFactory:
 
         def update_sprite(self, sprite):
             self.sprite = sprite
-            self.nodes[0].sprite = sprite
+            panel = self.nodes[0]
+            panel.sprite = sprite
+            # Тот же спрайт с изменёнными на месте пикселями присваивание
+            # не перерисует: значение не поменялось
+            panel.mark_dirty()
 
         def create_sprites(self, render: Render, pos_off=(0, 0)):
-            sprites = list()
-            for node in self.nodes:
-                sprites.extend(node.create_sprites(render, pos_off))
-            return sprites
+            return []
 
 
     class ElementsList(UINode):
 
+        __slots__ = ("ui_factory", "color", "force_element_height")
+
         ui_factory = AbstarctUIFactory
         color = tuple()
         force_element_height = int() # TODO Что-то с этим параметром сделать
+        layout_depends_on_children = True
 
         def __init__(self, pos, size, nodes,  **kwargs):
             super().__init__(pos, size, nodes, **kwargs)
             panel: UIPanel = self.ui_factory.Panel(
                 (0, 0), self.size, [], color=self.color)
             self.nodes.insert(0, panel)
-            self.update_list()
 
         def update_list(self):
-            x_off = y_off = 0
-            for node in self.nodes[1:]:
-                node.pos = (x_off, y_off)
+            self.mark_dirty(layout=True)
+
+        def place_nodes(self):
+            # Элементы идут столбиком, их собственный pos не учитывается
+            nodes = iter(self.nodes)
+            panel = next(nodes, None)
+            if panel is None:
+                return
+            yield panel.calc_pos(self.calc_next_node_pos(panel, self.abs_pos))
+            y_off = 0
+            for node in nodes:
+                x, y = self.calc_next_node_pos(node, self.abs_pos)
+                yield (x, y + y_off)
                 y_off += node.size[1]
 
         def add_elem(self, node, pos=-1):
@@ -161,24 +247,372 @@ class UIWidgetsFactory:
                 self.nodes.append(node)
             else:
                 self.nodes.insert(pos+1, node)
-            self.update_list()
 
         def rem_elem(self, pos):
             del self.nodes[pos + 1]
-            self.update_list()
 
         def get_elems(self):
             return self.nodes[1:]
 
         def create_sprites(self, render: Render, pos_off=(0, 0)):
-            sprites = list()
-            for node in self.nodes:
-                sprites.extend(node.create_sprites(render, pos_off))
-            return sprites
+            return []
+
+    class VirtualList(UINode):
+        """Список, который держит узлы только для видимых строк и overscan.
+        Строки берутся из data_source (нужны len() и [index]),
+        узлы строк создаёт row_factory() и заполняет bind_row(node, item, index).
+        Ушедшие из окна узлы переиспользуются для новых строк"""
+
+        __slots__ = ("ui_factory", "color", "data_source", "row_factory", "bind_row",
+                     "row_height", "overscan", "scroll_pos", "panel", "_rows", "_free_rows")
+
+        ui_factory = AbstarctUIFactory
+        color = tuple()
+        data_source = tuple()
+        row_factory = callable
+        bind_row = callable
+        row_height = 20
+        overscan = 2
+        scroll_pos = 0
+        clip = True
+        drag_scrolls = True
+        layout_props = UINode.layout_props | {"scroll_pos", "row_height"}
+
+        def __init__(self, pos, size, nodes, **kwargs):
+            super().__init__(pos, size, nodes, **kwargs)
+            self.panel: UIPanel = self.ui_factory.Panel(
+                (0, 0), self.size, [], color=self.color)
+            self._rows = dict()  # index -> node
+            self._free_rows = list()
+            self.nodes = [self.panel]
+            self.update_rows()
+
+        def visible_range(self):
+            count = len(self.data_source)
+            first = self.scroll_pos // self.row_height - self.overscan
+            last = (self.scroll_pos + self.size[1]) // self.row_height + 1 + self.overscan
+            return max(first, 0), min(last, count)
+
+        def update_rows(self, rebind=False):
+            first, last = self.visible_range()
+            for index in [index for index in self._rows if not first <= index < last]:
+                self._free_rows.append(self._rows.pop(index))
+            if rebind:
+                for index, node in self._rows.items():
+                    self.bind_row(node, self.data_source[index], index)
+
+            for index in range(first, last):
+                if index in self._rows:
+                    continue
+                node = self._free_rows.pop() if self._free_rows else self.row_factory()
+                self.bind_row(node, self.data_source[index], index)
+                self._rows[index] = node
+
+            self.nodes = [self.panel] + [self._rows[index] for index in range(first, last)]
+
+        def refresh(self):
+            """Перечитать data_source: поменялось число строк или их содержимое"""
+            self.scroll_to(self.scroll_pos, rebind=True)
+
+        def scroll_to(self, scroll_pos, rebind=False):
+            max_scroll = len(self.data_source) * self.row_height - self.size[1]
+            self.scroll_pos = max(0, min(scroll_pos, max_scroll))
+            self.update_rows(rebind)
+
+        def place_nodes(self):
+            yield self.panel.calc_pos(self.calc_next_node_pos(self.panel, self.abs_pos))
+            first, _last = self.visible_range()
+            for index, node in enumerate(self.nodes[1:], first):
+                x, y = self.calc_next_node_pos(node, self.abs_pos)
+                yield (x, y + index * self.row_height - self.scroll_pos)
+
+        def mouse_wheel(self, _wheel_x, wheel_y):
+            self.scroll_to(self.scroll_pos - wheel_y * WHEEL_ROWS * self.row_height)
+
+        def mouse_drag(self, _pos_mouse, pos_mouse_dff):
+            self.scroll_to(self.scroll_pos - pos_mouse_dff[1])
+
+        def create_sprites(self, render: Render, pos_off=(0, 0)):
+            return []
+
+    class ColorGrid(UINode):
+        """Сетка одноцветных ячеек cols x rows без узла на каждую ячейку.
+        Цвета лежат в array("I") в формате ARGB8888, вся сетка рисуется
+        одним спрайтом. Полное обновление масштабирует буфер ячеек в спрайт
+        одним SDL_BlitScaled, точечное перекрашивает только изменённые ячейки.
+        grid_size и element_size задаются при создании"""
+
+        __slots__ = ("ui_factory", "grid_size", "element_size", "color", "cell_click",
+                     "cells", "_cells_sprite", "_canvas", "_changed", "_full_update")
+
+        ui_factory = AbstarctUIFactory
+        grid_size = (0, 0)
+        element_size = (1, 1)
+        color = (0, 0, 0, 255)
+        cell_click = None  # fun(col, row)
+        pass_mouse_pos = True
+        sprite_props = frozenset(("size",))
+        snapshot_skip = UINode.snapshot_skip | {
+            "_cells_sprite", "_canvas", "_changed", "_full_update"}
+
+        def __init__(self, pos, size, nodes, **kwargs):
+            super().__init__(pos, size, nodes, **kwargs)
+            cols, rows = self.grid_size
+            self.cells = array.array("I", [pack_color(self.color)]) * (cols * rows)
+            self._create_cells_sprite()
+
+        def __setstate__(self, state):
+            super().__setstate__(state)
+            self._create_cells_sprite()
+
+        def _create_cells_sprite(self):
+            cols, rows = self.grid_size
+            # Поверхность поверх памяти self.cells, без копирования
+            address, _length = self.cells.buffer_info()
+            cells_surface = sdl2.SDL_CreateRGBSurfaceWithFormatFrom(
+                address, cols, rows, 32, cols * self.cells.itemsize,
+                sdl2.SDL_PIXELFORMAT_ARGB8888)
+            if not cells_surface:
+                raise sdl2.ext.SDLError()
+            sdl2.SDL_SetSurfaceBlendMode(cells_surface, sdl2.SDL_BLENDMODE_NONE)
+            self._cells_sprite = sdl2.ext.SoftwareSprite(cells_surface.contents, True)
+            self._canvas = None
+            self._changed = set()
+            self._full_update = True
+
+        def invalidate_sprites(self):
+            super().invalidate_sprites()
+            self._full_update = True
+
+        def cell_at(self, pos):
+            """(col, row) ячейки под точкой pos или None"""
+            w, h = self.element_size
+            col = (pos[0] - self.abs_pos[0]) // w
+            row = (pos[1] - self.abs_pos[1]) // h
+            if 0 <= col < self.grid_size[0] and 0 <= row < self.grid_size[1]:
+                return (col, row)
+            return None
+
+        def get_cell(self, col, row):
+            return unpack_color(self.cells[row * self.grid_size[0] + col])
+
+        def set_cell(self, col, row, color):
+            index = row * self.grid_size[0] + col
+            value = pack_color(color)
+            if self.cells[index] != value:
+                self.cells[index] = value
+                self._changed.add(index)
+                w, h = self.element_size
+                self.mark_damaged((col * w, row * h, w, h))
+
+        def set_cells(self, colors):
+            """colors: любой буфер (array, bytes, numpy.uint32) с cols * rows
+            значениями ARGB8888 построчно"""
+            view = memoryview(colors).cast("B")
+            if view.nbytes != self.cells.itemsize * len(self.cells):
+                raise ValueError("colors size does not match grid_size")
+            memoryview(self.cells).cast("B")[:] = view
+            self._full_update = True
+            self.mark_dirty()
+
+        def fill(self, color):
+            self.cells[:] = array.array("I", [pack_color(color)]) * len(self.cells)
+            self._full_update = True
+            self.mark_dirty()
+
+        def mouse_click(self, pos_mouse):
+            cell = self.cell_at(pos_mouse)
+            if cell is not None and self.cell_click:
+                return self.cell_click(*cell)
+            return None
+
+        def create_sprites(self, render: Render, pos_off=(0, 0)):
+            if self._sprites is None:
+                canvas = sdl2.SDL_CreateRGBSurfaceWithFormat(
+                    0, self.size[0], self.size[1], 32, sdl2.SDL_PIXELFORMAT_ARGB8888)
+                if not canvas:
+                    raise sdl2.ext.SDLError()
+                self._canvas = sdl2.ext.SoftwareSprite(canvas.contents, True)
+                self._update_canvas()
+                if render.renderer:
+                    self._sprites = [render.sprite_factory.from_surface(self._canvas.surface)]
+                else:
+                    self._sprites = [self._canvas]
+            elif self._full_update or self._changed:
+                area = self._update_canvas()
+                if render.renderer:
+                    self._upload(area)
+            self._sprites[0].position = pos_off
+            return self._sprites
+
+        def _update_canvas(self):
+            """Переносит изменения ячеек на холст. Возвращает изменённую область"""
+            canvas = self._canvas.surface
+            cols, rows = self.grid_size
+            w, h = self.element_size
+            if self._full_update or len(self._changed) * 4 > cols * rows:
+                sdl2.SDL_BlitScaled(self._cells_sprite.surface, None, canvas, None)
+                area = (0, 0, canvas.w, canvas.h)
+            else:
+                x0, y0, x1, y1 = canvas.w, canvas.h, 0, 0
+                for index in self._changed:
+                    row, col = divmod(index, cols)
+                    sdl2.SDL_FillRect(canvas, sdl2.SDL_Rect(col * w, row * h, w, h),
+                                      self.cells[index])
+                    x0, y0 = min(x0, col * w), min(y0, row * h)
+                    x1, y1 = max(x1, (col + 1) * w), max(y1, (row + 1) * h)
+                area = (x0, y0, x1 - x0, y1 - y0)
+            self._full_update = False
+            self._changed.clear()
+            return area
+
+        def _upload(self, area):
+            canvas = self._canvas.surface
+            x, y, w, h = area
+            pixels = canvas.pixels + y * canvas.pitch + x * 4
+            sdl2.SDL_UpdateTexture(self._sprites[0].texture, sdl2.SDL_Rect(*area),
+                                   ctypes.c_void_p(pixels), canvas.pitch)
+
+    class StreamImage(UINode):
+        """Картинка, которую часто перезаписывают целиком или по частям
+        (кадры камеры, графики). Узел владеет одной поверхностью ARGB8888
+        размером size: write() переводит пиксели буфера прямо в неё
+        (SDL_ConvertPixels), без новых поверхностей и спрайтов. В TEXTURE
+        в текстуру загружается только изменившаяся область, а на экране
+        перерисовывается только она (UINode.mark_damaged).
+        При изменении size картинка заливается color заново"""
+
+        __slots__ = ("ui_factory", "color", "_canvas", "_changed_area")
+
+        ui_factory = AbstarctUIFactory
+        color = (0, 0, 0, 0)  # Заливка новой картинки
+        sprite_props = frozenset(("size",))
+        snapshot_skip = UINode.snapshot_skip | {"_canvas", "_changed_area"}
+        _canvas = None
+        _changed_area = None  # (x0, y0, x1, y1) холста, ещё не загруженные в текстуру
+
+        def __init__(self, pos, size, nodes, **kwargs):
+            super().__init__(pos, size, nodes, **kwargs)
+            self._create_canvas()
+
+        def __setstate__(self, state):
+            super().__setstate__(state)
+            self._create_canvas()
+
+        def _create_canvas(self):
+            canvas = sdl2.SDL_CreateRGBSurfaceWithFormat(
+                0, self.size[0], self.size[1], 32, sdl2.SDL_PIXELFORMAT_ARGB8888)
+            if not canvas:
+                raise sdl2.ext.SDLError()
+            sdl2.SDL_SetSurfaceBlendMode(canvas, sdl2.SDL_BLENDMODE_BLEND)
+            sdl2.SDL_FillRect(canvas, None, pack_color(self.color))
+            self._canvas = sdl2.ext.SoftwareSprite(canvas.contents, True)
+            self._changed_area = None
+
+        def invalidate_sprites(self):
+            super().invalidate_sprites()
+            if tuple(self._canvas.size) != tuple(self.size):
+                self._create_canvas()
+
+        def write(self, pixels, rect=None, pixel_format=sdl2.SDL_PIXELFORMAT_ARGB8888,
+                  pitch=None):
+            """Записывает пиксели в область rect = (x, y, w, h) картинки,
+            по умолчанию во всю.
+
+            pixels — numpy-массив или любой объект с протоколом буфера:
+            h строк по w пикселей в формате pixel_format (SDL_PIXELFORMAT_*),
+            строки начинаются через pitch байт (по умолчанию шаг строк
+            массива или w * байт на пиксель). Буфер читается сразу, после
+            write его можно переписывать. Вызывается в потоке UI"""
+            canvas = self._canvas.surface
+            x, y, w, h = self._image_rect(rect)
+            if w <= 0 or h <= 0:
+                return
+            if sdl2.SDL_ISPIXELFORMAT_FOURCC(pixel_format) and \
+                    pixel_format not in PACKED_YUV_FORMATS:
+                raise ValueError("planar pixel formats are not supported")
+            row = w * sdl2.SDL_BYTESPERPIXEL(pixel_format)
+            if not row:
+                raise ValueError("unknown pixel format")
+            address, buffer_pitch, nbytes, _owner = _pixels_address(pixels)
+            pitch = pitch or buffer_pitch or row
+            if pitch < row or (h - 1) * pitch + row > nbytes:
+                raise ValueError("pixels buffer is smaller than rect")
+
+            sdl2.SDL_LockSurface(canvas)
+            try:
+                result = sdl2.SDL_ConvertPixels(
+                    w, h, pixel_format, ctypes.c_void_p(address), pitch,
+                    sdl2.SDL_PIXELFORMAT_ARGB8888,
+                    ctypes.c_void_p(canvas.pixels + y * canvas.pitch + x * 4), canvas.pitch)
+            finally:
+                sdl2.SDL_UnlockSurface(canvas)
+            if result != 0:
+                raise sdl2.ext.SDLError()
+            self._changed(x, y, w, h)
+
+        def fill(self, color, rect=None):
+            """Заливает область rect (по умолчанию всю картинку) цветом color"""
+            x, y, w, h = self._image_rect(rect)
+            if w <= 0 or h <= 0:
+                return
+            sdl2.SDL_FillRect(self._canvas.surface, sdl2.SDL_Rect(x, y, w, h),
+                              pack_color(color))
+            self._changed(x, y, w, h)
+
+        def _image_rect(self, rect):
+            canvas = self._canvas.surface
+            if rect is None:
+                return (0, 0, canvas.w, canvas.h)
+            x, y, w, h = rect
+            if x < 0 or y < 0 or x + w > canvas.w or y + h > canvas.h:
+                raise ValueError("rect is outside the image")
+            return rect
+
+        def _changed(self, x, y, w, h):
+            x0, y0, x1, y1 = self._changed_area or (x, y, x + w, y + h)
+            self._changed_area = (min(x0, x), min(y0, y), max(x1, x + w), max(y1, y + h))
+            self.mark_damaged((x, y, w, h))
+
+        def create_sprites(self, render: Render, pos_off=(0, 0)):
+            if self._sprites is None:
+                if render.renderer:
+                    w, h = self.size
+                    self._sprites = [render.surface_pool.texture(w, h, renderer=render.renderer)]
+                    self._changed_area = (0, 0, w, h)
+                else:
+                    # Спрайт — сам холст: write() сразу виден при выводе
+                    self._sprites = [self._canvas]
+            if self._changed_area is not None:
+                if render.renderer:
+                    self._upload(self._changed_area)
+                self._changed_area = None
+            self._sprites[0].position = pos_off
+            return self._sprites
+
+        def _upload(self, area):
+            canvas = self._canvas.surface
+            x0, y0, x1, y1 = area
+            pixels = canvas.pixels + y0 * canvas.pitch + x0 * 4
+            sdl2.SDL_UpdateTexture(self._sprites[0].texture,
+                                   sdl2.SDL_Rect(x0, y0, x1 - x0, y1 - y0),
+                                   ctypes.c_void_p(pixels), canvas.pitch)
 
     class ElementsMatrixAxis(UINode):
 
+        __slots__ = ("ui_factory", "cell_off")
+
         ui_factory = AbstarctUIFactory
+        layout_depends_on_children = True
+        cell_off = None  # Смещение ячейки, выставляется ElementsMatrix
+
+        def place_nodes(self):
+            if self.cell_off is None:
+                yield from super().place_nodes()
+                return
+            for node in self.nodes:
+                x, y = self.calc_next_node_pos(node, self.abs_pos)
+                yield (x + self.cell_off[0], y + self.cell_off[1])
 
         def add_elem(self, node, pos=-1):
             if pos == -1:
@@ -193,48 +627,43 @@ class UIWidgetsFactory:
             return self.nodes
 
         def create_sprites(self, render: Render, pos_off=(0, 0)):
-            sprites = list()
-            for node in self.nodes:
-                sprites.extend(node.create_sprites(render, pos_off))
-            return sprites
+            return []
 
     class ElementsMatrix(UINode):
 
+        __slots__ = ("ui_factory", "color", "element_size")
+
         ui_factory = AbstarctUIFactory
         color = tuple()
         element_size = (int(), int())
-
-        def __init__(self, pos, size, nodes,  **kwargs):
-            super().__init__(pos, size, nodes, **kwargs)
-            self.update_matrix()
+        layout_props = UINode.layout_props | {"element_size"}
+        layout_depends_on_children = True
 
         def update_matrix(self):
-            w, h = self.element_size
+            self.mark_dirty(layout=True)
 
+        def place_nodes(self):
+            # Ячейки [x][y] ставятся в (x * w, y * h), их собственный pos не учитывается
+            w, h = self.element_size
             for x, x_axis in enumerate(self.nodes):
                 for y, y_axis in enumerate(x_axis.nodes):
-                    for _z, node in enumerate(y_axis.nodes):
-                        node.pos = (x * w, y * h)
+                    y_axis.cell_off = (x * w, y * h)
+                yield x_axis.calc_pos(self.calc_next_node_pos(x_axis, self.abs_pos))
 
         def add_elem(self, node, pos=-1):
             if pos == -1:
                 self.nodes.append(node)
             else:
                 self.nodes.insert(pos+1, node)
-            self.update_matrix()
 
         def rem_elem(self, pos):
             del self.nodes[pos + 1]
-            self.update_matrix()
 
         def get_elems(self):
             return self.nodes[1:]
 
         def create_sprites(self, render: Render, pos_off=(0, 0)):
-            sprites = list()
-            for node in self.nodes:
-                sprites.extend(node.create_sprites(render, pos_off))
-            return sprites
+            return []
 
     def button(self, pos, size, nodes=None, **kwargs):
         """kwargs = {
@@ -244,7 +673,7 @@ class UIWidgetsFactory:
             "color": (r, g, b, a)
             "color_hover": (r, g, b, a)
             "color_press": (r, g, b, a)
-            "click_event" : fun()
+            "click_event" : fun() | async fun() # корутина — только в SimpleUI.run_async
             "align": ALIGN
             "text_size" : int()
         }"""
@@ -256,6 +685,14 @@ class UIWidgetsFactory:
     def direct_sprite(self, pos, size, sprite, **kwargs):
         return self.DirectSprite(pos, size, None, ui_factory=self.ui_factory, sprite=sprite,**kwargs)
 
+    def stream_image(self, pos, size, **kwargs):
+        """kwargs = {
+            "s_id": str()
+            "color": (r, g, b, a) # Заливка до первого write
+            "align": ALIGN
+        }"""
+        return self.StreamImage(pos, size, None, ui_factory=self.ui_factory, **kwargs)
+
     def elements_list(self, pos, size, nodes=None, **kwargs):
         """kwargs = {
             "s_id": str()
@@ -264,6 +701,29 @@ class UIWidgetsFactory:
         }"""
         return self.ElementsList(pos, size, nodes, ui_factory=self.ui_factory, **kwargs)
 
+    def virtual_list(self, pos, size, data_source, row_factory, bind_row, **kwargs):
+        """kwargs = {
+            "s_id": str()
+            "color": (r, g, b, a)
+            "align": ALIGN
+            "row_height": int()
+            "overscan": int() # Запас строк за краями окна
+        }"""
+        return self.VirtualList(pos, size, None, ui_factory=self.ui_factory,
+                                data_source=data_source, row_factory=row_factory,
+                                bind_row=bind_row, **kwargs)
+
+    def color_grid(self, pos, grid_size, element_size, **kwargs):
+        """kwargs = {
+            "s_id": str()
+            "color": (r, g, b, a) # Начальный цвет ячеек
+            "align": ALIGN
+            "cell_click" : fun(col, row)
+        }"""
+        size = (grid_size[0] * element_size[0], grid_size[1] * element_size[1])
+        return self.ColorGrid(pos, size, None, ui_factory=self.ui_factory,
+                              grid_size=grid_size, element_size=element_size, **kwargs)
+
     def elements_matrix(self, pos, nodes=None, **kwargs):
         """kwargs = {
             "s_id": str()
@@ -0,0 +1,37 @@
+"""Общее для тестов: окна без экрана (SDL_VIDEODRIVER=dummy) и шрифт"""
+import ctypes
+import os
+import sys
+import unittest
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sdl2
+import sdl2.ext
+
+FONT = os.environ.get("SIMPLEPYUI_FONT") or os.path.join(
+    os.path.dirname(sdl2.__file__), "examples", "resources", "tuffy.ttf")
+
+needs_font = unittest.skipUnless(os.path.exists(FONT), "no font: set SIMPLEPYUI_FONT")
+
+
+def create_window(size):
+    sdl2.ext.init()
+    return sdl2.ext.Window("test", size)
+
+
+def window_pixels(window):
+    """Содержимое поверхности окна байтами"""
+    surface = window.get_surface()
+    return ctypes.string_at(surface.pixels, surface.pitch * surface.h)
+
+
+def first_difference(window_a, window_b):
+    """Первая точка (x, y), где окна одного размера различаются, или None"""
+    a, b = window_pixels(window_a), window_pixels(window_b)
+    if a == b:
+        return None
+    surface = window_a.get_surface()
+    offset = next(i for i, (x, y) in enumerate(zip(a, b)) if x != y)
+    return (offset % surface.pitch) // 4, offset // surface.pitch
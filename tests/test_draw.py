@@ -0,0 +1,125 @@
+import random
+import unittest
+
+from support import FONT, create_window, first_difference, needs_font
+
+from simplePyUI.main import Render, UIFactory
+from simplePyUI.widgets import UIWidgetsFactory
+
+WIN_SIZE = (320, 240)
+BOXES = 12
+WHITE = (255, 255, 255, 255)
+
+
+def random_color(rnd):
+    return (rnd.randrange(256), rnd.randrange(256), rnd.randrange(256), 255)
+
+
+def initial_state(rnd):
+    return {
+        "pos": [(rnd.randint(-20, 140), rnd.randint(-10, 90)) for _ in range(BOXES)],
+        "color": [random_color(rnd) for _ in range(BOXES)],
+        "text": ["b%d" % i for i in range(BOXES)],
+        "removed": set(),
+        "scroll": 0,
+        "cells": dict(),
+    }
+
+
+def build(window, state):
+    """Дерево, нарисованное по state с нуля"""
+    factory = UIFactory(window)
+    widgets = UIWidgetsFactory(factory)
+    boxes = [factory.Panel(state["pos"][i], (40, 24), [
+        factory.Text((0, 0), (40, 24), [], text=state["text"][i], color=WHITE, text_size=12),
+    ], color=state["color"][i], s_id="box%d" % i) for i in range(BOXES)]
+    half = BOXES // 2
+    clipped = factory.Panel((10, 10), (150, 110), [
+        box for i, box in enumerate(boxes[:half]) if i not in state["removed"]
+    ], color=(20, 20, 20, 255), clip=True, s_id="clipped")
+    layer = factory.Panel((160, 10), (150, 110), [
+        box for i, box in enumerate(boxes[half:], half) if i not in state["removed"]
+    ], color=(30, 30, 30, 255), cache_subtree=True, s_id="layer")
+    rows = widgets.virtual_list(
+        (10, 130), (150, 100), list(range(50)),
+        lambda: factory.Panel((0, 0), (150, 20), [], color=(0, 0, 0, 255)),
+        lambda node, item, index: setattr(node, "color", (item * 5, 40, 90, 255)),
+        color=(5, 5, 5, 255), s_id="rows")
+    rows.scroll_to(state["scroll"])
+    grid = widgets.color_grid((170, 130), (10, 10), (10, 10), color=(60, 60, 60, 255), s_id="grid")
+    for (col, row), color in state["cells"].items():
+        grid.set_cell(col, row, color)
+    root = factory.Panel((0, 0), WIN_SIZE, [clipped, layer, rows, grid], color=(0, 0, 0, 255))
+    return root, boxes
+
+
+@needs_font
+class DirtyRectsTest(unittest.TestCase):
+    """Кадры, нарисованные по изменившимся областям, совпадают попиксельно
+    с тем же деревом, нарисованным целиком"""
+
+    def setUp(self):
+        self.window = create_window(WIN_SIZE)
+        self.reference_window = create_window(WIN_SIZE)
+
+    def tearDown(self):
+        self.window.close()
+        self.reference_window.close()
+
+    def assert_matches_full_redraw(self, state, frame):
+        root, _boxes = build(self.reference_window, state)
+        render = Render(self.reference_window, root, FONT)
+        try:
+            render.draw()
+            self.assertIsNone(first_difference(self.window, self.reference_window),
+                              "frame %d differs from a full redraw" % frame)
+        finally:
+            render.close()
+
+    def mutate(self, rnd, render, boxes, state):
+        i = rnd.randrange(BOXES)
+        op = rnd.choice(("pos", "color", "text", "toggle", "scroll", "cell"))
+        if op == "pos":
+            state["pos"][i] = boxes[i].pos = (rnd.randint(-20, 140), rnd.randint(-10, 90))
+        elif op == "color":
+            state["color"][i] = boxes[i].color = random_color(rnd)
+        elif op == "text":
+            state["text"][i] = boxes[i].nodes[0].text = "t%d" % rnd.randrange(1000)
+        elif op == "toggle":
+            parent = render.get_node_by_name("clipped" if i < BOXES // 2 else "layer")
+            if i in state["removed"]:
+                state["removed"].discard(i)
+                index = sum(1 for box in parent.nodes if int(box.s_id[3:]) < i)
+                parent.nodes.insert(index, boxes[i])
+            else:
+                state["removed"].add(i)
+                parent.nodes.remove(boxes[i])
+        elif op == "scroll":
+            rows = render.get_node_by_name("rows")
+            rows.scroll_to(rnd.randint(0, 900))
+            state["scroll"] = rows.scroll_pos
+        else:
+            cell, color = (rnd.randrange(10), rnd.randrange(10)), random_color(rnd)
+            state["cells"][cell] = color
+            render.get_node_by_name("grid").set_cell(cell[0], cell[1], color)
+
+    def test_random_changes(self):
+        rnd = random.Random(1)
+        state = initial_state(rnd)
+        root, boxes = build(self.window, state)
+        render = Render(self.window, root, FONT)
+        try:
+            render.draw()
+            self.assert_matches_full_redraw(state, 0)
+            for frame in range(1, 61):
+                for _ in range(rnd.randint(1, 3)):
+                    self.mutate(rnd, render, boxes, state)
+                render.draw()
+                if frame % 10 == 0:
+                    self.assert_matches_full_redraw(state, frame)
+        finally:
+            render.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
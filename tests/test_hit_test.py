@@ -0,0 +1,77 @@
+import random
+import unittest
+
+from support import FONT, create_window, needs_font
+
+from simplePyUI.main import ALIGN, Render, UIFactory
+
+WIN_SIZE = (400, 300)
+ALIGNS = (ALIGN.LEFT | ALIGN.TOP, ALIGN.HCENTER | ALIGN.VCENTER,
+          ALIGN.RIGHT | ALIGN.BOTTOM, ALIGN.RIGHT)
+
+
+def random_node(rnd, factory, depth):
+    nodes = [random_node(rnd, factory, depth - 1) for _ in range(rnd.randint(0, 4))] if depth else []
+    create = rnd.choice((factory.Panel, factory.Panel, factory.Text))
+    return create((rnd.randint(-20, 150), rnd.randint(-20, 150)),
+                  (rnd.randint(0, 200), rnd.randint(0, 200)), nodes,
+                  align=rnd.choice(ALIGNS), color=(1, 2, 3, 255), text="a")
+
+
+def walk(node):
+    yield node
+    for child in node.nodes:
+        yield from walk(child)
+
+
+@needs_font
+class HitTestTest(unittest.TestCase):
+    """Render.hit_test по сетке находит тот же узел, что и обход дерева
+    UINode.get_hovered_node, в том числе после изменений раскладки"""
+
+    def setUp(self):
+        self.window = create_window(WIN_SIZE)
+        self.factory = UIFactory(self.window)
+
+    def tearDown(self):
+        self.window.close()
+
+    def assert_same_nodes(self, rnd, render, step):
+        root = render.start_ui_node
+        for _ in range(500):
+            pos = (rnd.randint(-10, WIN_SIZE[0] + 10), rnd.randint(-10, WIN_SIZE[1] + 10))
+            self.assertIs(render.hit_test(pos), root.get_hovered_node(pos),
+                          "step %d, point %r" % (step, pos))
+
+    def mutate(self, rnd, root):
+        node = rnd.choice(list(walk(root)))
+        op = rnd.random()
+        if op < 0.3:
+            node.pos = (rnd.randint(-20, 150), rnd.randint(-20, 150))
+        elif op < 0.5:
+            node.size = (rnd.randint(0, 200), rnd.randint(0, 200))
+        elif op < 0.6 and node.nodes:
+            node.nodes.pop(rnd.randrange(len(node.nodes)))
+        elif op < 0.7:
+            node.nodes.insert(0, self.factory.Panel((3, 3), (40, 40), color=(1, 1, 1, 255)))
+        elif op < 0.8:
+            node.align = rnd.choice(ALIGNS)
+        elif node is not root:
+            node.clickable = not node.clickable
+
+    def test_random_tree(self):
+        rnd = random.Random(1)
+        root = self.factory.Panel((0, 0), WIN_SIZE, [
+            random_node(rnd, self.factory, 4) for _ in range(4)], color=(0, 0, 0, 255))
+        render = Render(self.window, root, FONT)
+        try:
+            self.assert_same_nodes(rnd, render, 0)
+            for step in range(1, 31):
+                self.mutate(rnd, root)
+                self.assert_same_nodes(rnd, render, step)
+        finally:
+            render.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import unittest
+
+from support import FONT, create_window, first_difference, needs_font
+
+from simplePyUI.abstarct_classes import AbstarctUIFactory
+from simplePyUI.main import ALIGN, Render, UIFactory, UINode, UIPanel
+from simplePyUI.reconcile import Reconciler, element
+
+WIN_SIZE = (320, 260)
+WHITE = (255, 255, 255, 255)
+
+
+def on_click():
+    pass
+
+
+def row_factory():
+    return UIPanel((0, 0), (120, 20), [], color=(0, 0, 0, 255))
+
+
+def bind_row(node, item, index):
+    node.color = (item, 60, 120, 255)
+
+
+def screen(items, title="title", ok_type="button", ok_color=(40, 40, 40, 255),
+           title_size=24, rows=range(0, 200, 10), corner=True):
+    """Описание экрана; параметры меняют его так, как меняет приложение"""
+    title_props = dict(text=title, s_id="title", color=(10, 10, 10, 255), color_text=WHITE)
+    if title_size is not None:
+        title_props["text_size"] = title_size
+    ok_props = dict(text="ok", s_id="ok", color=ok_color, color_text=WHITE)
+    if ok_type == "button":
+        ok_props.update(color_hover=(50, 50, 50, 255), color_press=(60, 60, 60, 255),
+                        click_event=on_click)
+    return [
+        element("label", (0, 0), (200, 20), **title_props),
+        element("elements_list", (0, 30), (120, 150), [
+            element("label", (0, 0), (120, 20), text=item, s_id="row_" + item,
+                    color=(20, 20, 20, 255), color_text=WHITE)
+            for item in items], s_id="list", color=(30, 30, 30, 255)),
+        element(ok_type, (0, 200), (80, 30), **ok_props),
+        element("color_grid", (100, 200), grid_size=(4, 2), element_size=(8, 8), s_id="grid"),
+        element("virtual_list", (180, 30), (120, 100), data_source=list(rows),
+                row_factory=row_factory, bind_row=bind_row, s_id="rows", color=(5, 5, 5, 255)),
+        element("Panel", (-10, -10), (40, 20), [
+            element("Text", (0, 0), (40, 20), text="x", color=WHITE)], color=(70, 70, 70, 255),
+            **({"align": ALIGN.RIGHT | ALIGN.BOTTOM} if corner else {})),
+    ]
+
+
+STEPS = (
+    screen(["a", "b", "c"]),
+    screen(["a", "b", "c"]),
+    screen(["c", "a", "b", "d"], title="title 2"),
+    screen(["d"], ok_color=(90, 10, 10, 255), rows=range(100, 0, -10)),
+    screen(["d", "e"], title_size=None, corner=False),
+    screen(["e", "d"], ok_type="label"),
+    screen(["a", "b", "c"]),
+)
+
+
+def node_state(node):
+    """Поля узла без кэшей, ссылок на другие узлы и фабрики"""
+    return {key: val for key, val in node.__getstate__().items()
+            if not key.startswith("_") and key != "nodes"
+            and not isinstance(val, (UINode, AbstarctUIFactory))}
+
+
+@needs_font
+class ReconcileTest(unittest.TestCase):
+    """Дерево, приведённое Reconciler.reconcile к описанию, совпадает
+    с деревом, заново построенным Reconciler.create по тому же описанию"""
+
+    def setUp(self):
+        self.window = create_window(WIN_SIZE)
+        self.reference_window = create_window(WIN_SIZE)
+
+    def tearDown(self):
+        self.window.close()
+        self.reference_window.close()
+
+    def assert_same_tree(self, node, reference, path):
+        self.assertIs(type(node), type(reference), path)
+        self.assertEqual(node_state(node), node_state(reference), path)
+        self.assertEqual(len(node.nodes), len(reference.nodes), path)
+        for index, (child, reference_child) in enumerate(zip(node.nodes, reference.nodes)):
+            self.assert_same_tree(child, reference_child, "%s/%d" % (path, index))
+
+    def test_matches_create(self):
+        factory = UIFactory(self.window)
+        root = factory.Panel((0, 0), WIN_SIZE, [], color=(0, 0, 0, 255))
+        render = Render(self.window, root, FONT)
+        reconciler = Reconciler(factory)
+        try:
+            for step, descriptions in enumerate(STEPS):
+                reconciler.reconcile(root, descriptions)
+                render.draw()
+
+                reference_factory = UIFactory(self.reference_window)
+                created = Reconciler(reference_factory)
+                reference = reference_factory.Panel((0, 0), WIN_SIZE, [
+                    created.create(description) for description in descriptions
+                ], color=(0, 0, 0, 255))
+                reference_render = Render(self.reference_window, reference, FONT)
+                try:
+                    reference_render.draw()
+                    self.assert_same_tree(root, reference, "step %d" % step)
+                    self.assertIsNone(first_difference(self.window, self.reference_window),
+                                      "step %d" % step)
+                finally:
+                    reference_render.close()
+        finally:
+            render.close()
+
+
+if __name__ == "__main__":
+    unittest.main()